@@ -1,6 +1,6 @@
 import metamathpy.proof as mp
 import metamathpy.piletrie as mt
-from metamathpy.substitution import substitute, Scheme, multibinder, pilebinder
+from metamathpy.substitution import substitute, Scheme, PileIndex, multibinder, pilebinder
 try:
     profile
 except NameError:
@@ -111,7 +111,7 @@ class OrNode:
                     if not success: break
                     dependencies[label] = step
                 if len(dependencies) < len(and_node.dependencies): continue
-                return True, mp.ProofStep(self.tokens, and_node.rule, dependencies, and_node.substitution, self.disjoint)
+                return True, mp.ProofStep(self.tokens, and_node.rule, dependencies, and_node.substitution, mp.disjoint_masks(self.disjoint))
 
         return False, None
 
@@ -123,6 +123,7 @@ def backsearch(goal, rules, disjoint=None, pile=None, max_depth=-1, verbose=Fals
       rules: list of rule objects to use as justifications
       disjoint: disjoint variable requirements of claim, if any
       pile: dictionary of proof steps available for satisfying leaves, if any (pile[step.conclusion] = step)
+        indexed once as a substitution.PileIndex and shared with the recursive calls
       max_depth: if >= 0, dont search past this depth
       verbose: if True, print debug messages
     returns (success, rootstep)
@@ -133,6 +134,7 @@ def backsearch(goal, rules, disjoint=None, pile=None, max_depth=-1, verbose=Fals
 
     # initialize arguments if not provided
     if pile is None: pile = {}
+    if not isinstance(pile, PileIndex): pile = PileIndex(pile)
 
     # check if current goal already proved in pile
     if goal in pile: return True, pile[goal]
@@ -193,7 +195,7 @@ def backsearch(goal, rules, disjoint=None, pile=None, max_depth=-1, verbose=Fals
 
                         if verbose: print(" "*max_depth + f">>> {' '.join(goal)} <={rule.consequent.label}{psub}_/({len(dependencies)})[wv:{bindings}]")
 
-                        return True, mp.ProofStep(goal, rule, dependencies, substitution | bindings, inherited)
+                        return True, mp.ProofStep(goal, rule, dependencies, substitution | bindings, mp.disjoint_masks(inherited))
 
                 else:
                     # no work variables, try backsearching each hypothesis
@@ -217,7 +219,7 @@ def backsearch(goal, rules, disjoint=None, pile=None, max_depth=-1, verbose=Fals
                     if verbose: print(" "*max_depth + f">>> {' '.join(goal)} <={rule.consequent.label}{psub}_/({len(dependencies)})")
 
                     # otherwise, it worked, construct and return root step
-                    return True, mp.ProofStep(goal, rule, dependencies, substitution, inherited)
+                    return True, mp.ProofStep(goal, rule, dependencies, substitution, mp.disjoint_masks(inherited))
 
     # no rules worked
     return False, None
@@ -300,7 +302,7 @@ def backsearch_trie(goal, rules, disjoint=None, pile_root=None, max_depth=-1, ve
 
                         if verbose: print(" "*max_depth + f">>> {' '.join(goal)} <={rule.consequent.label}{psub}_/({len(dependencies)})[wv:{bindings}]")
 
-                        return True, mp.ProofStep(goal, rule, dependencies, substitution | bindings, inherited)
+                        return True, mp.ProofStep(goal, rule, dependencies, substitution | bindings, mp.disjoint_masks(inherited))
 
                 else:
                     # no work variables, try backsearching each hypothesis
@@ -324,7 +326,7 @@ def backsearch_trie(goal, rules, disjoint=None, pile_root=None, max_depth=-1, ve
                     if verbose: print(" "*max_depth + f">>> {' '.join(goal)} <={rule.consequent.label}{psub}_/({len(dependencies)})")
 
                     # otherwise, it worked, construct and return root step
-                    return True, mp.ProofStep(goal, rule, dependencies, substitution, inherited)
+                    return True, mp.ProofStep(goal, rule, dependencies, substitution, mp.disjoint_masks(inherited))
 
     # no rules worked
     return False, None
@@ -3,9 +3,15 @@ Run from parent directory with
 $ python -m src.database
 """
 from collections import namedtuple
+from collections.abc import Mapping
+from array import array
 import itertools as it
+import hashlib
+import mmap
+import os
+import pickle as pk
 
-from src.metamathpy.substitution import Scheme, substitute
+from src.metamathpy.substitution import Scheme, Template, substitute
 
 try:
     profile
@@ -29,6 +35,8 @@ Frame:
         constant or variable symbol if tag in "cv"
         list of disjoint variables if tag is "d"
         hypothesis if tag in "ef"
+Scope:
+    cumulative state of a stack of frames, see class below
 """
 
 Statement = namedtuple('Statement', ('label', 'tag', 'tokens', 'proof'))
@@ -45,7 +53,18 @@ Statement = namedtuple('Statement', ('label', 'tag', 'tokens', 'proof'))
 #         if self.tag == "$p": s += f"$= {' '.join(self.proof)} $."
 #         return s
 
+def freeze(statement):
+    """
+    returns statement with its tokens as a tuple
+    already frozen statements are returned as-is so that they can be shared between rules
+    """
+    if type(statement.tokens) is tuple: return statement
+    return Statement(statement.label, statement.tag, tuple(statement.tokens), statement.proof)
+
 class Rule:
+    # no per-instance __dict__, a full set.mm load has tens of thousands of rules
+    __slots__ = ("consequent", "essentials", "floatings", "disjoint", "variables", "hypotheses", "_mandatory", "_scheme", "_templates", "_disjoint_slots")
+
     def __init__(self, consequent, essentials, floatings, disjoint, variables):
         self.consequent = consequent
         self.essentials = essentials
@@ -53,19 +72,56 @@ class Rule:
         self.disjoint = disjoint
         self.variables = variables
     def finalize(self):
-        self.consequent = Statement(self.consequent.label, self.consequent.tag, tuple(self.consequent.tokens), self.consequent.proof)
-        self.essentials = tuple(Statement(e.label, e.tag, tuple(e.tokens), e.proof) for e in self.essentials)
-        self.floatings = tuple(Statement(f.label, f.tag, tuple(f.tokens), f.proof) for f in self.floatings)
+        self.consequent = freeze(self.consequent)
+        self.essentials = tuple(map(freeze, self.essentials))
+        self.floatings = tuple(map(freeze, self.floatings))
         self.hypotheses = self.floatings + self.essentials
-        self.mandatory = {f.tokens[1]: f.tokens[0] for f in self.floatings} # varname: typecode
-        self.scheme = Scheme(self.consequent.tokens, self.variables)
+        # not needed for verification, built on first access
+        self._mandatory = None
+        self._scheme = None
+        self._templates = None
+        self._disjoint_slots = None
+
+    @property
+    def mandatory(self):
+        if self._mandatory is None:
+            self._mandatory = {f.tokens[1]: f.tokens[0] for f in self.floatings} # varname: typecode
+        return self._mandatory
+
+    @property
+    def scheme(self):
+        if self._scheme is None:
+            self._scheme = Scheme(self.consequent.tokens, self.variables)
+        return self._scheme
+
+    @property
+    def templates(self):
+        """
+        templates[n]: the nth essential hypothesis precompiled for substitution, templates[-1]: the consequent
+        slot i of each template is the variable of the ith floating hypothesis
+        """
+        if self._templates is None:
+            variables = tuple(f.tokens[1] for f in self.floatings)
+            self._templates = tuple(Template(s.tokens, variables) for s in self.essentials + (self.consequent,))
+        return self._templates
+
+    @property
+    def disjoint_slots(self):
+        """
+        disjoint variable pairs between mandatory variables, as (i, j) indices into floatings with i < j
+        """
+        if self._disjoint_slots is None:
+            slot = {f.tokens[1]: i for (i, f) in enumerate(self.floatings)}
+            pairs = [(slot[u], slot[v]) for (u, v) in self.disjoint if u in slot and v in slot]
+            self._disjoint_slots = tuple(sorted((min(i, j), max(i, j)) for (i, j) in pairs))
+        return self._disjoint_slots
 
     def __str__(self):
-        s = f"{self.consequent.label} {self.consequent.tag} {' '.join(self.consequent.tokens)} $.\n"
-        s += f"disjoint variable sets: {self.disjoint}\n"
+        s = f"{self.consequent.label} {self.consequent.tag} {' '.join(map(str, self.consequent.tokens))} $.\n"
+        s += f"disjoint variable sets: {{{', '.join(map(str, sorted(self.disjoint)))}}}\n"
         s += f"{len(self.hypotheses)} hypotheses:\n"
         for hypothesis in self.hypotheses:
-            s += f"  {hypothesis.label} {hypothesis.tag} {' '.join(hypothesis.tokens)} $.\n"
+            s += f"  {hypothesis.label} {hypothesis.tag} {' '.join(map(str, hypothesis.tokens))} $.\n"
         return s
 
     def rename(self, name_map):
@@ -85,9 +141,9 @@ class Rule:
 
     def mm(self, prefix=""):
         essentials = [
-            f"{essential.label} $e {' '.join(essential.tokens)}"
+            f"{essential.label} $e {' '.join(map(str, essential.tokens))}"
             for essential in self.essentials]
-        consequent = f"{self.consequent.label} {self.consequent.tag} {' '.join(self.consequent.tokens)} "
+        consequent = f"{self.consequent.label} {self.consequent.tag} {' '.join(map(str, self.consequent.tokens))} "
         if self.consequent.tag == "$p":
             if len(self.consequent.proof) > 0:
                 proof = " ".join(self.consequent.proof)
@@ -102,10 +158,194 @@ class Rule:
 
 def new_frame(): return {tag: [] for tag in "cvdfe"}
 
+class Scope:
+    """
+    Cumulative state of all frames in scope, updated incrementally as blocks open and close
+    variables: set of active variables
+    essentials[n]: the nth active essential hypothesis
+    floatings[v]: (n, f) where f is the active floating hypothesis for variable v, and the nth one declared
+    disjoint: set of active disjoint variable pairs (u, v) with u < v
+    history[k]: actions that undo the changes made in the kth innermost block, applied when it closes
+    Attaching the scope to an assertion costs time proportional to its own statement and hypotheses
+    The variable and disjoint pair sets are shared (as frozensets) by all assertions until the next change
+    """
+    def __init__(self, frames=None):
+        self.variables = set()
+        self.essentials = []
+        self.floatings = {}
+        self.disjoint = set()
+        self.num_floatings = 0
+        self.history = [[]]
+        self._variables = frozenset()
+        self._disjoint = frozenset()
+
+        # replay any initial frames, outermost first
+        if frames is None: frames = [new_frame()]
+        for f, frame in enumerate(frames):
+            if f > 0: self.push()
+            self.add_variables(frame["v"])
+            for disjoint in frame["d"]: self.add_disjoint(disjoint)
+            for floating in frame["f"]: self.add_floating(floating)
+            for essential in frame["e"]: self.add_essential(essential)
+
+    def push(self):
+        self.history.append([])
+
+    def pop(self):
+        for action in reversed(self.history.pop()): action()
+
+    def add_variables(self, variables):
+        new = set(variables) - self.variables
+        if len(new) == 0: return
+        self.variables |= new
+        self._variables = None
+        self.history[-1].append(lambda: self._remove_variables(new))
+
+    def _remove_variables(self, variables):
+        self.variables -= variables
+        self._variables = None
+
+    def add_disjoint(self, variables):
+        new = set(it.combinations(sorted(variables), 2)) - self.disjoint
+        if len(new) == 0: return
+        self.disjoint |= new
+        self._disjoint = None
+        self.history[-1].append(lambda: self._remove_disjoint(new))
+
+    def _remove_disjoint(self, pairs):
+        self.disjoint -= pairs
+        self._disjoint = None
+
+    def add_floating(self, floating):
+        variable = floating.tokens[1]
+        previous = self.floatings.get(variable)
+        self.floatings[variable] = (self.num_floatings, floating)
+        self.num_floatings += 1
+        if previous is None:
+            self.history[-1].append(lambda: self.floatings.pop(variable))
+        else:
+            self.history[-1].append(lambda: self.floatings.__setitem__(variable, previous))
+
+    def add_essential(self, essential):
+        self.essentials.append(essential)
+        self.history[-1].append(self.essentials.pop)
+
+    def attach(self, rule):
+        """
+        fill in the variables, hypotheses and disjoint pairs of an assertion rule from the current scope
+        """
+        if self._variables is None: self._variables = frozenset(self.variables)
+        if self._disjoint is None: self._disjoint = frozenset(self.disjoint)
+        rule.variables = self._variables
+        rule.disjoint = self._disjoint
+        rule.essentials = list(self.essentials)
+
+        # identify mandatory variables
+        mandatory = set(filter(self.variables.__contains__, rule.consequent.tokens))
+        for essential in rule.essentials:
+            mandatory.update(filter(self.variables.__contains__, essential.tokens))
+
+        # mandatory floating hypotheses in order of declaration
+        floatings = sorted(self.floatings[v] for v in mandatory if v in self.floatings)
+        rule.floatings = [floating for (_, floating) in floatings]
+
+class PrefixView(Mapping):
+    """
+    Lightweight view of the first entries of an ordered dictionary, without copying them
+    base: the underlying dictionary (or another view)
+    positions[key]: the insertion position of key in base
+    stop: number of leading entries of base that are visible
+    excluded: set of keys hidden from the view
+    Popping or deleting a key only hides it in the view, base is never modified
+    """
+    def __init__(self, base, positions, stop, excluded=()):
+        self.base = base
+        self.positions = positions
+        self.stop = stop
+        self.excluded = set(excluded)
+
+    def __contains__(self, key):
+        return key not in self.excluded and self.positions.get(key, self.stop) < self.stop
+
+    def __getitem__(self, key):
+        if key not in self: raise KeyError(key)
+        return self.base[key]
+
+    def __iter__(self):
+        for key in it.islice(self.base, self.stop):
+            if key not in self.excluded: yield key
+
+    def __len__(self):
+        return self.stop - sum(1 for key in self.excluded if self.positions.get(key, self.stop) < self.stop)
+
+    def __delitem__(self, key):
+        if key not in self: raise KeyError(key)
+        self.excluded.add(key)
+
+    def pop(self, key, *default):
+        if key not in self:
+            if len(default) > 0: return default[0]
+            raise KeyError(key)
+        value = self.base[key]
+        self.excluded.add(key)
+        return value
+
+class SymbolTable:
+    """
+    Dense integer ids for the math symbols of an interned database
+    symbols[i]: the symbol (str) with id i
+    ids[symbol]: the id of symbol
+    """
+    def __init__(self):
+        self.symbols = []
+        self.ids = {}
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def intern(self, symbol):
+        # returns id of symbol, assigning the next one if it is new
+        if symbol not in self.ids:
+            self.ids[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
+        return self.ids[symbol]
+
+    def encode(self, tokens):
+        # returns tuple of ids for a sequence of symbols
+        return tuple(map(self.intern, tokens))
+
+    def decode(self, tokens):
+        # returns tuple of symbols for a sequence of ids
+        return tuple(self.symbols[i] for i in tokens)
+
 class Database:
     def __init__(self):
         self.statements = {} # looks up statements by label
         self.rules = {} # looks up rules by consequent's label
+        self.symbols = None # SymbolTable if tokens are interned as integer ids, otherwise None
+        self._positions = None # cached insertion positions of statement and rule labels
+
+    def positions(self):
+        """
+        returns (statement_positions, rule_positions), mapping labels to their insertion order
+        computed once and reused until the number of statements or rules changes
+        """
+        if self._positions is None or tuple(map(len, self._positions)) != (len(self.statements), len(self.rules)):
+            self._positions = tuple({label: n for n, label in enumerate(labels)} for labels in (self.statements, self.rules))
+        return self._positions
+
+    def prefix(self, last_label, exclude=()):
+        """
+        returns a database view truncated after the statement labeled last_label
+        rules, statements and the symbol table (if interned) are shared with self, not copied
+        labels in exclude are omitted from the rules of the view, their statements can still be looked up
+        """
+        statement_positions, rule_positions = self.positions()
+        view = Database()
+        view.symbols = self.symbols
+        view.statements = PrefixView(self.statements, statement_positions, statement_positions[last_label] + 1)
+        view.rules = PrefixView(self.rules, rule_positions, rule_positions[last_label] + 1, exclude)
+        return view
 
     def print(self, start=0, stop=0):
         if start < 0: start = len(self.rules) + start
@@ -156,10 +396,112 @@ class Database:
         return rules
 
 
-# @profile
-def parse(fpath, max_rules=-1, last_rule=""):
+def intern_symbols(db):
+    """
+    convert all math symbols in db to dense integer ids, in place
+    db.statements tokens become compact arrays of ids
+    rule statements become tuples of ids, so that they remain hashable for proof steps
+    variables and disjoint pairs are converted too, with each pair ordered by id
+    the symbol table is saved in db.symbols for decoding
+    """
+    symbols = SymbolTable()
+
+    # hypotheses are shared between rules, so convert each label once
+    converted = {}
+    def convert(statement):
+        if statement.label not in converted:
+            converted[statement.label] = Statement(statement.label, statement.tag, symbols.encode(statement.tokens), statement.proof)
+        return converted[statement.label]
+
+    # variable and disjoint sets can also be shared between rules in the same scope
+    shared = {}
+    def convert_variables(variables):
+        if id(variables) not in shared:
+            shared[id(variables)] = (variables, frozenset(symbols.encode(variables)))
+        return shared[id(variables)][1]
+    def convert_disjoint(disjoint):
+        if id(disjoint) not in shared:
+            shared[id(disjoint)] = (disjoint, frozenset((min(u, v), max(u, v)) for (u, v) in map(symbols.encode, disjoint)))
+        return shared[id(disjoint)][1]
+
+    for rule in db.rules.values():
+        rule.consequent = convert(rule.consequent)
+        rule.essentials = [convert(e) for e in rule.essentials]
+        rule.floatings = [convert(f) for f in rule.floatings]
+        rule.variables = convert_variables(rule.variables)
+        rule.disjoint = convert_disjoint(rule.disjoint)
+        rule.finalize()
 
-    db = Database()
+    for label, statement in db.statements.items():
+        db.statements[label] = Statement(label, statement.tag, array("I", symbols.encode(statement.tokens)), statement.proof)
+
+    db.symbols = symbols
+
+def read_lines(fpath):
+    """
+    default tokenizer: yields the list of whitespace-separated tokens on each line of fpath
+    """
+    with open(fpath, "r") as f:
+        for line in f: yield line.split()
+
+def find_token(buffer, token, start):
+    """
+    returns position of the next whitespace-delimited occurrence of token in buffer at or after start, or -1
+    """
+    while True:
+        pos = buffer.find(token, start)
+        if pos < 0: return pos
+        stop = pos + len(token)
+        if (pos == 0 or buffer[pos-1:pos].isspace()) and (stop == len(buffer) or buffer[stop:stop+1].isspace()):
+            return pos
+        start = pos + 1
+
+def mmap_lines(fpath):
+    """
+    faster tokenizer: same lines as read_lines(fpath), but with comments already removed
+    memory-maps the file, skips each $( ... $) comment with one search for its end,
+    and splits the text between comments in bulk
+    """
+    with open(fpath, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0: return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+
+            pending = [] # tokens of the current line so far
+            pos = 0
+            while True:
+
+                # split text up to the next comment into lines
+                start = find_token(buffer, b"$(", pos)
+                text = buffer[pos:(len(buffer) if start < 0 else start)].decode("utf-8")
+                pieces = text.split("\n")
+                pending.extend(pieces[0].split())
+                for piece in pieces[1:]:
+                    yield pending
+                    pending = piece.split()
+
+                if start < 0: break
+
+                # skip the comment, keeping an empty line for each line it covers
+                stop = find_token(buffer, b"$)", start + 2)
+                assert stop >= 0, "Last comment never terminated"
+                newlines = buffer[start:stop].count(b"\n")
+                if newlines > 0:
+                    yield pending
+                    yield from it.repeat([], newlines - 1)
+                    pending = []
+                pos = stop + 2
+
+            if len(pending) > 0: yield pending
+
+# @profile
+def parse_lines(db, lines, frames=None, max_rules=-1, last_rule="", first_line=0):
+    """
+    parser state machine
+    consumes lines[n], the list of tokens on the nth line, and adds statements and rules to db in place
+    frames: initial stack of frames in scope (defaults to one empty global frame, see Scope)
+    first_line: line number of lines[0] for error messages
+    generator that yields each rule as soon as it is finalized
+    """
 
     # parser state
     in_comment = False # whether currently in comment
@@ -167,110 +509,249 @@ def parse(fpath, max_rules=-1, last_rule=""):
     label = None # most recent label
     statement = None # most recent statement
     rule = None # most recent rule
-    frames = [new_frame()] # stack of frames in current scope
+    scope = Scope(frames) # cumulative state of all frames in scope
 
     # dbg = False
 
-    with open(fpath, "r") as f:
-        for n, line in enumerate(f):
+    for n, line in enumerate(lines, start=first_line):
+
+        if len(db.rules) == max_rules: break
+        if rule is not None and rule.consequent.label == last_rule: break
+
+        for token in line:
+
+            # if label == "df-alsc": dbg = True
+            # if dbg:
+            #     db.print(start=-2)
+            #     print(f"token='{token}', label='{label}', tag='{current_tag}'")
+            #     print(statement)
+            #     input('..')    
+
+            # skip comments
+            if token == "$(": in_comment = True
+            elif token == "$)": in_comment = False
+            if in_comment: continue
+
+            # update scope
+            if token == "${": scope.push()
+            elif token == "$}": scope.pop()
+
+            # initialize declarations
+            elif token in ("$c", "$v", "$d"):
+                statement = Statement(label, token, [], [])
 
-            if len(db.rules) == max_rules: break
-            if rule is not None and rule.consequent.label == last_rule: break
+            # initialize labeled statements
+            elif token in ("$f", "$e", "$a", "$p"):
+                assert label != None, \
+                       f"line {n+1}: {token} not preceded by label"
 
-            for token in line.strip().split():
+                statement = Statement(label, token, [], [])
+                db.statements[label] = statement
 
-                # if label == "df-alsc": dbg = True
-                # if dbg:
-                #     db.print(start=-2)
-                #     print(f"token='{token}', label='{label}', tag='{current_tag}'")
-                #     print(statement)
-                #     input('..')    
+            # handle non-tag tokens
+            elif token[0] != "$":
 
-                # skip comments
-                if token == "$(": in_comment = True
-                elif token == "$)": in_comment = False
-                if in_comment: continue
+                # update label
+                label = token
+
+                # update statements
+                if current_tag is not None:
+                    if current_tag in "cvdfeap":
+                        statement.tokens.append(token)
+                    elif current_tag == "=":
+                        statement.proof.append(token)
+
+            # handle completed statements and rules
+            elif token == "$.":
 
                 # update scope
-                if token == "${": frames.append(new_frame())
-                elif token == "$}": frames.pop()
-
-                # initialize declarations
-                elif token in ("$c", "$v", "$d"):
-                    statement = Statement(label, token, [], [])
-
-                # initialize labeled statements
-                elif token in ("$f", "$e", "$a", "$p"):
-                    assert label != None, \
-                           f"line {n+1}: {token} not preceded by label"
-
-                    statement = Statement(label, token, [], [])
-                    db.statements[label] = statement
-
-                # handle non-tag tokens
-                elif token[0] != "$":
-
-                    # update label
-                    label = token
-
-                    # update statements
-                    if current_tag is not None:
-                        if current_tag in "cvdfeap":
-                            statement.tokens.append(token)
-                        elif current_tag == "=":
-                            statement.proof.append(token)
-
-                # handle completed statements and rules
-                elif token == "$.":
-
-                    # update frame
-                    if current_tag in "cv":
-                        frames[-1][current_tag].extend(statement.tokens)
-                    if current_tag == "d":
-                        frames[-1][current_tag].append(sorted(statement.tokens))
-                    if current_tag in "fe":
-                        frames[-1][current_tag].append(statement)
-
-                    # include placeholder "rules" for hypotheses
-                    if current_tag in "fea=":
-                        rule = Rule(statement, [], [], set(), set())
-
-                    # attach scope to axioms and propositions
-                    if current_tag in "a=":
-
-                        # get all variables and essential hypotheses in current scope
-                        for frame in frames:
-                            rule.variables.update(frame["v"])
-                            rule.essentials.extend(frame["e"])
-
-                        # identify mandatory variables
-                        tokens = set(statement.tokens)
-                        for essential in rule.essentials:
-                            tokens.update(essential.tokens)
-                        mandatory = rule.variables & tokens
-
-                        # save mandatory floating hypotheses
-                        for frame in frames:
-                            for floating in frame["f"]:
-                                if floating.tokens[1] in mandatory:
-                                    rule.floatings.append(floating)
-
-                        # get disjoint variable pairs
-                        for frame in frames:
-                            for disjoint in frame["d"]:
-                                rule.disjoint.update(it.combinations(disjoint, 2))
-
-                    # add completed statements and finalized rules to database
-                    if current_tag in "fea=":
-                        rule.finalize()
-                        db.statements[statement.label] = statement
-                        db.rules[statement.label] = rule
-
-                # update current tag
-                if token[0] == "$" and token[1] not in "()": current_tag = token[1]
-                if current_tag in ("$.", "$}"): current_tag = None
-
-        assert not in_comment, "Last comment never terminated"
+                if current_tag == "v":
+                    scope.add_variables(statement.tokens)
+                if current_tag == "d":
+                    scope.add_disjoint(statement.tokens)
+
+                # include placeholder "rules" for hypotheses
+                if current_tag in "fea=":
+                    rule = Rule(statement, [], [], set(), set())
+
+                # attach scope to axioms and propositions
+                if current_tag in "a=":
+                    scope.attach(rule)
+
+                # add completed statements and finalized rules to database
+                if current_tag in "fea=":
+                    rule.finalize()
+                    db.statements[statement.label] = rule.consequent
+                    db.rules[statement.label] = rule
+                    yield rule
+
+                # frozen hypotheses are shared by every rule in their scope
+                if current_tag == "f": scope.add_floating(rule.consequent)
+                if current_tag == "e": scope.add_essential(rule.consequent)
+
+            # update current tag
+            if token[0] == "$" and token[1] not in "()": current_tag = token[1]
+            if current_tag in ("$.", "$}"): current_tag = None
+
+    assert not in_comment, "Last comment never terminated"
+
+def scan_segments(lines, num_segments):
+    """
+    light pre-pass over lines that finds where they can be split for independent parsing
+    splits are only made at line starts outside of comments, blocks and statements,
+        and not between a label and the keyword of its statement
+    only the declarations in the outermost scope are collected along the way
+    returns list of (start, stop, frame) where lines[start:stop] is one segment
+        and frame is the outermost frame in effect at the start of the segment
+    """
+
+    in_comment = False
+    depth = 0 # nesting depth of ${ $} blocks
+    current_tag = None
+    label = None
+    pending_label = False # a label was read but not its keyword yet, possibly on a later line
+    statement = None
+    frame = new_frame()
+
+    target = len(lines) / num_segments # approximate number of lines per segment
+    starts, frames = [0], [new_frame()]
+
+    for n, tokens in enumerate(lines):
+
+        # split here if segment is long enough and no state other than the outer frame is carried over
+        if n >= target * len(starts) and depth == 0 and not in_comment and current_tag in (None, ".", "}") and not pending_label:
+            starts.append(n)
+            frames.append({tag: list(decls) for (tag, decls) in frame.items()})
+
+        for token in tokens:
+
+            # skip comments
+            if token == "$(": in_comment = True
+            elif token == "$)": in_comment = False
+            if in_comment: continue
+
+            if token[0] != "$":
+                label = token
+                if current_tag in (None, ".", "}"): pending_label = True
+                # only collect outermost declarations
+                if depth == 0 and current_tag in ("c", "v", "d", "f", "e"): statement.tokens.append(token)
+                continue
+
+            if token == "${": depth += 1
+            elif token == "$}": depth -= 1
+            elif token in ("$c", "$v", "$d", "$f", "$e"): statement = Statement(label, token, [], [])
+            elif token == "$." and depth == 0:
+                if current_tag in "cv": frame[current_tag].extend(statement.tokens)
+                if current_tag == "d": frame[current_tag].append(sorted(statement.tokens))
+                if current_tag in "fe": frame[current_tag].append(statement)
+
+            if token[1] not in "()":
+                current_tag = token[1]
+                pending_label = False
+
+    assert not in_comment, "Last comment never terminated"
+
+    stops = starts[1:] + [len(lines)]
+    return list(zip(starts, stops, frames))
+
+# lines of the file being parsed, set in each worker process of a parallel parse
+_worker_lines = None
+
+def _init_parse_worker(lines):
+    global _worker_lines
+    _worker_lines = lines
+
+def _parse_segment(segment):
+    start, stop, frame = segment
+    db = Database()
+    for _ in parse_lines(db, _worker_lines[start:stop], [frame], first_line=start): pass
+    return db.statements, db.rules
+
+# @profile
+def parse_file(fpath, max_rules=-1, last_rule="", processes=1, tokenizer=read_lines):
+    """
+    parse fpath into a new Database
+    if processes > 1, the file is split into segments at outermost scope boundaries,
+    which are parsed independently on a process pool and merged in their original order
+    truncated parses (max_rules or last_rule provided) are always serial
+    """
+
+    db = Database()
+
+    if processes == 1 or max_rules != -1 or last_rule != "":
+        for _ in parse_lines(db, tokenizer(fpath), max_rules=max_rules, last_rule=last_rule): pass
+        return db
+
+    # several segments per process to balance load
+    lines = list(tokenizer(fpath))
+    segments = scan_segments(lines, 4 * processes)
+
+    # fork-based workers inherit lines without pickling them
+    import multiprocessing as mp
+    with mp.Pool(processes, initializer=_init_parse_worker, initargs=(lines,)) as pool:
+        for statements, rules in pool.imap(_parse_segment, segments):
+            db.statements.update(statements)
+            db.rules.update(rules)
+
+    return db
+
+# bump whenever the layout of Database, Rule, Statement or Scheme changes
+SNAPSHOT_VERSION = 9
+
+def snapshot_path(fpath, cache_dir, max_rules=-1, last_rule="", interned=False):
+    """
+    path of the on-disk snapshot for parsing fpath with the given arguments
+    the name is keyed by the file contents, the parse arguments and SNAPSHOT_VERSION,
+    so any edit to the source file automatically misses the stale snapshot
+    """
+    digest = hashlib.sha256()
+    with open(fpath, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    digest.update(f"|{max_rules}|{last_rule}|{interned}|{SNAPSHOT_VERSION}".encode())
+    stem = os.path.splitext(os.path.basename(fpath))[0]
+    return os.path.join(cache_dir, f"{stem}.{digest.hexdigest()[:32]}.pkl")
+
+def load_snapshot(path):
+    """
+    returns the database pickled at path, or None if missing or unreadable
+    """
+    try:
+        with open(path, "rb") as f: return pk.load(f)
+    except (OSError, EOFError, pk.UnpicklingError, AttributeError, ImportError):
+        return None
+
+def save_snapshot(db, path):
+    """
+    atomically pickle db at path so concurrent processes never see a partial snapshot
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f: pk.dump(db, f, protocol=pk.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
+
+def parse(fpath, max_rules=-1, last_rule="", cache_dir=None, processes=1, tokenizer=read_lines, interned=False):
+    """
+    parse the .mm file at fpath into a Database
+    max_rules: stop after this many rules (-1 means no limit)
+    last_rule: stop after the line where the rule with this label is completed
+    cache_dir: if provided, reuse (or create) a snapshot of the parsed database in this directory
+    processes: number of processes for parallel parsing (the result is the same as a serial parse)
+    tokenizer: function of fpath that yields the list of tokens on each line (read_lines or mmap_lines)
+    interned: if True, math symbols are replaced by integer ids (see intern_symbols)
+    """
+
+    # try warm load from snapshot
+    if cache_dir is not None:
+        path = snapshot_path(fpath, cache_dir, max_rules, last_rule, interned)
+        db = load_snapshot(path)
+        if db is not None: return db
+
+    db = parse_file(fpath, max_rules, last_rule, processes, tokenizer)
+    if interned: intern_symbols(db)
+
+    # save snapshot for next time
+    if cache_dir is not None: save_snapshot(db, path)
 
     return db
 
@@ -0,0 +1,85 @@
+"""
+Label dependency graph of the theorems in a database, for targeted re-verification after edits
+Run from top-level directory with
+$ python -m src.metamathpy.depgraph
+"""
+from src.metamathpy.proof import verify_each
+
+def proof_labels(rule):
+    """
+    returns the labels referenced by the proof of rule, in order of first reference
+    for compressed proofs these are the step labels between the parentheses
+    """
+    proof = rule.consequent.proof
+    if len(proof) > 0 and proof[0] == "(":
+        return proof[1:proof.index(")")]
+    return list(dict.fromkeys(label for label in proof if label != "?"))
+
+class DependencyGraph:
+    """
+    Dependency graph between the assertions of a database
+    uses[label]: labels of the $a and $p rules that the proof of $p rule label refers to
+    users[label]: labels of the $p rules whose proofs refer to label
+    order[label]: position of the rule in the database
+        every proof only refers to earlier rules, so sorting by order is a topological sort
+    """
+    def __init__(self, database):
+        self.order = {label: r for (r, label) in enumerate(database.rules)}
+        self.uses = {}
+        self.users = {}
+        for label, rule in database.rules.items():
+            if rule.consequent.tag != "$p": continue
+            uses = []
+            for used in proof_labels(rule):
+                # hypotheses are part of the theorem's own frame, not dependencies
+                if used in database.rules and database.rules[used].consequent.tag in ("$f", "$e"): continue
+                uses.append(used)
+                self.users.setdefault(used, []).append(label)
+            self.uses[label] = uses
+
+    def affected(self, changed, transitive=True):
+        """
+        changed: labels whose statements or proofs were added, modified or removed
+        returns the $p labels that need verification again, in topological order:
+            the changed theorems themselves and the theorems whose proofs use a changed label
+        if transitive, users of affected theorems are included too, recursively
+            (a proof only depends on the statements it uses, so this is only needed when
+            the statements of those theorems may have changed as well)
+        """
+        affected = {label for label in changed if label in self.uses}
+        frontier = list(changed)
+        while len(frontier) > 0:
+            label = frontier.pop()
+            for user in self.users.get(label, ()):
+                if user in affected: continue
+                affected.add(user)
+                if transitive: frontier.append(user)
+        return sorted(affected, key=self.order.__getitem__)
+
+def verify_affected(database, changed, graph=None, transitive=True, processes=1):
+    """
+    verify only the theorems affected by changes to the given labels (see DependencyGraph.affected)
+    graph: dependency graph of database, built if not provided
+    yields (label, ok, message) for each affected theorem in topological order, like proof.verify_each
+    """
+    if graph is None: graph = DependencyGraph(database)
+    yield from verify_each(database, labels=graph.affected(changed, transitive), processes=processes)
+
+if __name__ == "__main__":
+
+    import os
+    from time import perf_counter
+    from src.metamathpy.database import parse
+
+    fpath = os.path.join(os.environ["HOME"], "metamath", "set.mm")
+    db = parse(fpath)
+
+    start = perf_counter()
+    graph = DependencyGraph(db)
+    print(f"built graph of {len(graph.uses)} theorems in {perf_counter()-start:.2f}s")
+
+    start = perf_counter()
+    affected = graph.affected(["syl"], transitive=False)
+    for label, ok, message in verify_affected(db, ["syl"], graph, transitive=False):
+        assert ok, f"{label}: {message}"
+    print(f"verified {len(affected)} direct users of syl in {perf_counter()-start:.2f}s")
@@ -0,0 +1,331 @@
+"""
+Byte-offset index of the statements in a .mm file, for random access without a full parse
+Run from top-level directory with
+$ python -m src.metamathpy.index
+"""
+import hashlib
+import mmap
+import os
+import pickle as pk
+import re
+from collections.abc import Mapping
+
+from src.metamathpy.database import Database, find_token, parse, parse_lines, SNAPSHOT_VERSION
+
+try:
+    profile
+except NameError:
+    profile = lambda x: x
+
+# bump whenever the layout of StatementIndex changes
+INDEX_VERSION = 2
+
+# keywords that affect scope, optionally preceded by a label
+KEYWORD = re.compile(rb"(?:(?<!\S)([^\s$]\S*)\s+)?(?<!\S)\$([cvdfeap{}(])(?!\S)")
+
+class StatementIndex:
+    """
+    Locations of all statements and scope declarations in a .mm file
+    labels[label]: (offset, block) for labeled statements in file order
+        offset: byte offset of the statement's label
+        block: index of the innermost block containing the statement
+    blocks[b]: (parent, declarations) for the bth block (block 0 is the outermost scope)
+        parent: index of the enclosing block (-1 for block 0)
+        declarations: byte offsets of the $v, $d, $f, $e statements directly in the block, in file order
+    size, mtime: file metadata when the index was built, to detect stale indices
+    digests[label]: (content, context) if requested when the index was built, otherwise empty
+        content: digest of the statement's source text
+        context: digest of all scope declarations visible to the statement
+    """
+    def __init__(self, size, mtime):
+        self.labels = {}
+        self.blocks = [(-1, [])]
+        self.size = size
+        self.mtime = mtime
+        self.digests = {}
+
+    def scope_chain(self, block):
+        """
+        returns list of blocks enclosing given block, outermost first
+        """
+        chain = []
+        while block >= 0:
+            chain.append(block)
+            block = self.blocks[block][0]
+        return chain[::-1]
+
+def digest(data):
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+@profile
+def build_index(fpath, digests=False):
+    """
+    one pass over fpath that records the byte offset and scope context of every statement
+    only keywords are visited in python, the text between them and each comment is skipped in bulk
+    if digests is True, also records content and context digests of every labeled statement
+    """
+    stat = os.stat(fpath)
+    index = StatementIndex(stat.st_size, stat.st_mtime_ns)
+    if stat.st_size == 0: return index
+
+    with open(fpath, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+
+        block = 0
+        pos = 0
+        contexts = [b""] # contexts[b]: running digest of declarations visible in open block b
+        while True:
+
+            match = KEYWORD.search(buffer, pos)
+            if match is None: break
+            label, tag = match.groups()
+            pos = match.end()
+
+            if tag == b"(":
+                stop = find_token(buffer, b"$)", pos)
+                assert stop >= 0, "Last comment never terminated"
+                pos = stop + 2
+                continue
+
+            # keyword position (or its label's, for labeled statements)
+            offset = match.start(2) - 1 if label is None else match.start(1)
+
+            if tag == b"{":
+                index.blocks.append((block, []))
+                block = len(index.blocks) - 1
+                contexts.append(contexts[-1])
+                continue
+            elif tag == b"}":
+                block = index.blocks[block][0]
+                contexts.pop()
+                continue
+            elif tag == b"c":
+                continue
+
+            # skip the statement body
+            stop = find_token(buffer, b"$.", pos)
+            assert stop >= 0, f"byte {offset}: statement never terminated"
+            pos = stop + 2
+
+            if tag in b"feap":
+                index.labels[label.decode()] = (offset, block)
+                if digests:
+                    content = digest(buffer[offset:pos])
+                    index.digests[label.decode()] = (content, contexts[-1])
+
+            if tag in b"vdfe":
+                index.blocks[block][1].append(offset)
+                if digests:
+                    contexts[-1] = digest(contexts[-1] + buffer[offset:pos])
+
+    return index
+
+def index_path(fpath, cache_dir):
+    stem = os.path.splitext(os.path.basename(fpath))[0]
+    return os.path.join(cache_dir, f"{stem}.index.pkl")
+
+def load_index(fpath, cache_dir=None):
+    """
+    returns the persisted index of fpath in cache_dir, rebuilding and saving it if missing or stale
+    without cache_dir, the index is built and not saved
+    """
+    if cache_dir is None: return build_index(fpath)
+
+    path = index_path(fpath, cache_dir)
+    stat = os.stat(fpath)
+    try:
+        with open(path, "rb") as f: version, index = pk.load(f)
+        if (version, index.size, index.mtime) == (INDEX_VERSION, stat.st_size, stat.st_mtime_ns): return index
+    except (OSError, EOFError, pk.UnpicklingError, AttributeError, ImportError, ValueError):
+        pass
+
+    index = build_index(fpath)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f: pk.dump((INDEX_VERSION, index), f, protocol=pk.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
+    return index
+
+def read_statement(buffer, offset):
+    """
+    returns the tokens of the statement starting at byte offset, up to and including its $.
+    comments inside the statement are removed
+    """
+    stop = find_token(buffer, b"$.", offset)
+    assert stop >= 0, f"byte {offset}: statement never terminated"
+    tokens = []
+    in_comment = False
+    for token in buffer[offset:stop+2].decode("utf-8").split():
+        if token == "$(": in_comment = True
+        elif token == "$)": in_comment = False
+        elif not in_comment: tokens.append(token)
+    return tokens
+
+@profile
+def materialize(index, buffer, label):
+    """
+    parses just the rule with given label and the scope declarations that precede it
+    returns the rule
+    """
+    offset, block = index.labels[label]
+
+    # replay the scope: each enclosing block with its declarations up to this statement
+    lines = []
+    for depth, scope_block in enumerate(index.scope_chain(block)):
+        if depth > 0: lines.append(["${"])
+        for declaration in index.blocks[scope_block][1]:
+            if declaration >= offset: break
+            lines.append(read_statement(buffer, declaration))
+    lines.append(read_statement(buffer, offset))
+
+    db = Database()
+    for _ in parse_lines(db, lines): pass
+    return db.rules[label]
+
+def diff(old_index, new_index):
+    """
+    compares two indices built with digests
+    returns dict of label lists: "added", "removed", and "modified" (changed text or scope)
+    """
+    old, new = old_index.digests, new_index.digests
+    return {
+        "added": [label for label in new if label not in old],
+        "removed": [label for label in old if label not in new],
+        "modified": [label for label in new if label in old and old[label] != new[label]],
+    }
+
+def reparse(db, old_index, fpath, max_changed=0.25):
+    """
+    updates db in place to match the current contents of fpath
+    old_index: index with digests of the file version that db was parsed from
+    only added and modified statements are parsed again, along with their scope declarations
+    if more than max_changed (fraction) of the statements changed, fpath is parsed in full instead
+    returns the new index and the changes reported by diff
+    """
+    index = build_index(fpath, digests=True)
+    changes = diff(old_index, index)
+    changed = set(changes["added"]) | set(changes["modified"])
+
+    if len(changed) > max_changed * len(index.labels):
+        rules = parse(fpath).rules
+    else:
+        with open(fpath, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            rules = {
+                label: materialize(index, buffer, label) if label in changed else db.rules[label]
+                for label in index.labels}
+
+    # patch the existing dictionaries so that other references to them see the update
+    db.rules.clear()
+    db.rules.update(rules)
+    db.statements.clear()
+    db.statements.update((label, rule.consequent) for (label, rule) in rules.items())
+    db._positions = None
+
+    return index, changes
+
+def incremental_path(fpath, cache_dir):
+    stem = os.path.splitext(os.path.basename(fpath))[0]
+    return os.path.join(cache_dir, f"{stem}.incremental.pkl")
+
+def parse_incremental(fpath, cache_dir):
+    """
+    parse fpath, reusing the last parse of the same path in cache_dir (even if the file was edited since)
+    returns the database and the changes reported by diff (everything is "added" on the first parse)
+    """
+    path = incremental_path(fpath, cache_dir)
+    try:
+        with open(path, "rb") as f: versions, index, db = pk.load(f)
+        assert versions == (INDEX_VERSION, SNAPSHOT_VERSION)
+    except (OSError, EOFError, pk.UnpicklingError, AttributeError, ImportError, ValueError, AssertionError):
+        versions, index, db = None, StatementIndex(0, 0), Database()
+
+    index, changes = reparse(db, index, fpath)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f: pk.dump(((INDEX_VERSION, SNAPSHOT_VERSION), index, db), f, protocol=pk.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
+
+    return db, changes
+
+class LazyRules(Mapping):
+    """
+    Rules of an indexed file, each one parsed on first access and cached
+    """
+    def __init__(self, index, buffer):
+        self.index = index
+        self.buffer = buffer
+        self.cache = {}
+
+    def __contains__(self, label):
+        return label in self.index.labels
+
+    def __getitem__(self, label):
+        if label not in self.cache:
+            if label not in self.index.labels: raise KeyError(label)
+            self.cache[label] = materialize(self.index, self.buffer, label)
+        return self.cache[label]
+
+    def __iter__(self):
+        return iter(self.index.labels)
+
+    def __len__(self):
+        return len(self.index.labels)
+
+class LazyStatements(Mapping):
+    """
+    Statements of an indexed file, shared with the consequents of the lazily parsed rules
+    """
+    def __init__(self, rules):
+        self.rules = rules
+
+    def __contains__(self, label):
+        return label in self.rules
+
+    def __getitem__(self, label):
+        return self.rules[label].consequent
+
+    def __iter__(self):
+        return iter(self.rules)
+
+    def __len__(self):
+        return len(self.rules)
+
+class LazyDatabase(Database):
+    """
+    Database-compatible access to a .mm file through its statement index
+    db.rules[label] parses only that rule (and its scope) on first access
+    keeps the file memory-mapped until close() is called
+    """
+    def __init__(self, fpath, cache_dir=None):
+        super().__init__()
+        self.index = load_index(fpath, cache_dir)
+        self._file = open(fpath, "rb")
+        self._buffer = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self.index.size > 0 else b""
+        self.rules = LazyRules(self.index, self._buffer)
+        self.statements = LazyStatements(self.rules)
+
+    def close(self):
+        if self.index.size > 0: self._buffer.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+if __name__ == "__main__":
+
+    from time import perf_counter
+
+    fpath = os.path.join(os.environ["HOME"], "metamath", "set.mm")
+
+    start = perf_counter()
+    index = build_index(fpath)
+    print(f"indexed {len(index.labels)} statements in {len(index.blocks)} blocks in {perf_counter()-start:.2f}s")
+
+    with LazyDatabase(fpath) as db:
+        start = perf_counter()
+        rule = db.rules['ax-mp']
+        print(f"materialized ax-mp in {1000*(perf_counter()-start):.1f}ms")
+        print(rule)
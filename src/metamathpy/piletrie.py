@@ -7,9 +7,16 @@ except NameError:
     profile = lambda x: x
 
 class PileTrieNode:
+    """
+    Node of a pile trie, for the token prefix along the path from the root
+    step: the step whose conclusion is that prefix, if any
+    children[token]: node for the prefix extended by token
+    count: number of steps stored at or under this node (how many pile entries start with the prefix)
+    """
     def __init__(self):
         self.step = None
         self.children = {}
+        self.count = 0
 
     @profile
     def traverse(self, prefix):
@@ -47,16 +54,21 @@ class PileTrieNode:
         """
         Insert a new step whose conclusion is given tokens
         Called recursively on the tail of the tokens
+        Returns True if no step was stored for the tokens yet (an existing one is replaced otherwise)
         """
 
         # base case: all tokens traversed
         if len(tokens) == 0:
+            new = self.step is None
             self.step = step
-            return
+            if new: self.count += 1
+            return new
 
         # recursive case: traverse tokens, constructing new nodes when needed
         if tokens[0] not in self.children: self.children[tokens[0]] = PileTrieNode()
-        self.children[tokens[0]].add(tokens[1:], step)
+        new = self.children[tokens[0]].add(tokens[1:], step)
+        if new: self.count += 1
+        return new
 
     def tree_string(self, prefix=""):
         s = ""
@@ -87,6 +99,7 @@ if __name__ == "__main__":
 
     assert root.lookup("ch -> ta".split()) is None
     assert root.lookup("ph -> ta".split()) is None
+    assert root.count == 4 and root.traverse(("-.",)).count == 2
 
     print("all tests passed, tree string:")
     print(root.tree_string())
@@ -0,0 +1,126 @@
+"""
+Streaming parse-and-verify: theorems are verified while the rest of the file is still being parsed
+Run from top-level directory with
+$ python -m src.metamathpy.pipeline
+"""
+import pickle as pk
+import queue
+
+from src.metamathpy.database import Database, parse_lines, read_lines
+from src.metamathpy.proof import verify_claim
+
+def _verify_worker(connection, worker, num_workers, results):
+    """
+    verifier stage: receives every parsed rule in file order through connection, in pickled batches
+    keeps its own copy of the database, and verifies every num_workers-th theorem starting at worker
+    puts (label, ok, message) on the results queue for each of them
+    then always puts the end marker (None, worker, error), error is "" if the whole input was handled
+    """
+    error = ""
+    try:
+        db = Database()
+        claims = 0
+        while True:
+            data = connection.recv_bytes()
+            if len(data) == 0: break
+            for rule in pk.loads(data):
+                label = rule.consequent.label
+                db.rules[label] = rule
+                db.statements[label] = rule.consequent
+                if rule.consequent.tag != "$p": continue
+                if claims % num_workers == worker: results.put(verify_claim(db, rule))
+                claims += 1
+    except BaseException as e:
+        error = repr(e)
+        raise
+    finally:
+        results.put((None, worker, error))
+
+def parse_and_verify(fpath, db=None, processes=1, batch_size=512, tokenizer=read_lines, poll_interval=1.0):
+    """
+    parse fpath into db and verify each theorem as soon as it and everything before it have been parsed
+    db: Database to parse into (a new one if not provided, pass one in to keep the parse)
+    processes: number of verifier processes, in addition to the parsing (calling) process
+        with processes == 1, verification is interleaved with parsing in the calling process
+        otherwise every batch of batch_size rules is pickled once and sent to all verifiers,
+        which split the theorems between them round-robin
+    tokenizer: as in database.parse
+    poll_interval: seconds between liveness checks of the verifiers while waiting for their results
+        raises RuntimeError if a verifier fails or exits without finishing its share
+    yields (label, ok, message) for each theorem, in file order if processes == 1 and in completion order otherwise
+    """
+    if db is None: db = Database()
+
+    if processes == 1:
+        for rule in parse_lines(db, tokenizer(fpath)):
+            if rule.consequent.tag == "$p": yield verify_claim(db, rule)
+        return
+
+    import multiprocessing as mp
+    results = mp.Queue()
+    connections, workers = [], []
+    for worker in range(processes):
+        receiver, sender = mp.Pipe(duplex=False)
+        workers.append(mp.Process(target=_verify_worker, args=(receiver, worker, processes, results), daemon=True))
+        workers[-1].start()
+        receiver.close()
+        connections.append(sender)
+
+    def send(batch):
+        data = pk.dumps(batch, protocol=pk.HIGHEST_PROTOCOL)
+        for connection in connections: connection.send_bytes(data)
+
+    finished = set()
+    def received(result):
+        # returns True for theorem results, records end markers and raises on failed verifiers
+        if result[0] is not None: return True
+        _, worker, error = result
+        if error != "": raise RuntimeError(f"verifier {worker} failed: {error}")
+        finished.add(worker)
+        return False
+
+    try:
+        # parser stage: send batches to the verifiers, passing along any results that are already done
+        batch = []
+        for rule in parse_lines(db, tokenizer(fpath)):
+            batch.append(rule)
+            if len(batch) < batch_size: continue
+            send(batch)
+            batch = []
+            while not results.empty():
+                result = results.get()
+                if received(result): yield result
+        if len(batch) > 0: send(batch)
+
+        # signal the end of the input and drain the remaining results
+        for connection in connections: connection.send_bytes(b"")
+        while len(finished) < processes:
+            try:
+                result = results.get(timeout=poll_interval)
+            except queue.Empty:
+                dead = [w for w in range(processes) if w not in finished and not workers[w].is_alive()]
+                if len(dead) == 0: continue
+                # the end marker of a verifier that just exited may still be in flight
+                try:
+                    result = results.get(timeout=poll_interval)
+                except queue.Empty:
+                    raise RuntimeError(f"verifier {dead[0]} exited with code {workers[dead[0]].exitcode} before finishing")
+            if received(result): yield result
+
+    finally:
+        for connection in connections: connection.close()
+        for worker in workers:
+            if worker.is_alive(): worker.terminate()
+            worker.join()
+
+if __name__ == "__main__":
+
+    import os
+    from time import perf_counter
+
+    fpath = os.path.join(os.environ["HOME"], "metamath", "set.mm")
+
+    start = perf_counter()
+    failures = [(label, message) for (label, ok, message) in parse_and_verify(fpath, processes=4) if not ok]
+    print(f"parsed and verified in {perf_counter()-start:.2f}s, {len(failures)} failures")
+    for label, message in failures: print(label, message)
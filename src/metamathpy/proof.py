@@ -3,6 +3,8 @@ Run from top-level directory with
 $ python -m src.metamathpy.proof
 """
 import itertools as it
+from collections.abc import Mapping
+from functools import lru_cache
 
 try:
     profile
@@ -16,11 +18,11 @@ def substitute(symbols, substitution):
     substitution[v]: symbol string to put in place of symbol v
     returns result[n]: nth token after substitutions applied
     """
-    result = ()
+    result = []
     for symbol in symbols:
         if symbol in substitution: result += substitution[symbol]
-        else: result += (symbol,)
-    return result
+        else: result.append(symbol)
+    return tuple(result)
 
 def compose(t, s):
     """
@@ -34,42 +36,150 @@ def compose(t, s):
         if k not in s: ts[k] = v
     return ts
 
+# bit position of every variable symbol seen so far, for bitmask disjoint variable checks
+# positions are assigned on first use and are only meaningful within one process
+_variable_bits = {}
+_variable_symbols = []
+
+def variable_mask(symbols):
+    """
+    returns bitmask with the bit of each given variable symbol set
+    """
+    mask = 0
+    for symbol in symbols:
+        bit = _variable_bits.get(symbol)
+        if bit is None:
+            bit = _variable_bits[symbol] = len(_variable_symbols)
+            _variable_symbols.append(symbol)
+        mask |= 1 << bit
+    return mask
+
+def mask_variables(mask):
+    """
+    returns the variable symbols whose bits are set in mask
+    """
+    symbols = []
+    while mask:
+        low = mask & -mask
+        symbols.append(_variable_symbols[low.bit_length() - 1])
+        mask ^= low
+    return symbols
+
+def hypothesis_mask(rule, variables=None):
+    """
+    bitmask of the variables in the consequent of a hypothesis-less rule used as a proof step
+    variables: the variables in scope of the claim being proved, needed for its essential hypotheses
+    returns None for essential hypotheses if variables is not provided
+    """
+    tokens = rule.consequent.tokens
+    if rule.consequent.tag == "$f": return variable_mask(tokens[1:2])
+    if rule.consequent.tag == "$e":
+        if variables is None: return None
+        return variable_mask(variables.intersection(tokens))
+    return variable_mask(rule.variables.intersection(tokens))
+
+@lru_cache(maxsize=4096)
+def disjoint_partners(disjoint):
+    """
+    disjoint: frozenset of disjoint variable pairs
+    returns dict partners[b]: bitmask of the variables disjoint from the variable with bit b
+    """
+    partners = {}
+    for (u, v) in disjoint:
+        if u not in _variable_bits or v not in _variable_bits: variable_mask((u, v))
+        u_bit, v_bit = _variable_bits[u], _variable_bits[v]
+        partners[u_bit] = partners.get(u_bit, 0) | (1 << v_bit)
+        partners[v_bit] = partners.get(v_bit, 0) | (1 << u_bit)
+    return partners
+
+def missing_disjoint(inherited, partners):
+    """
+    inherited: disjoint requirements as (u_mask, v_mask) pairs, every variable in u_mask disjoint from every one in v_mask
+    partners: result of disjoint_partners for the available requirements
+    returns the set of required (x, y) variable pairs (x < y) that are not available
+    """
+    missing = set()
+    for (u_mask, v_mask) in inherited:
+        while u_mask:
+            low = u_mask & -u_mask
+            absent = v_mask & ~partners.get(low.bit_length() - 1, 0)
+            if absent:
+                x = mask_variables(low)[0]
+                for y in mask_variables(absent): missing.add((min(x, y), max(x, y)))
+            u_mask ^= low
+    return missing
+
 class ProofStep:
     """
     Proof step: represents one step of a proof
     conclusion: the symbol string that is concluded by applying an inference rule
     rule: the rule object that was applied
-    dependencies[h]: another ProofStep object, whose conclusion satisfies the rule hypothesis with label h
+    premises[i]: another ProofStep object, whose conclusion satisfies rule.hypotheses[i] (None if not provided)
+        empty tuple for steps without dependencies
+    dependencies[h]: dict-like view of premises by hypothesis label (see Dependencies)
+        can also be assigned (and passed to the constructor) as a dict by label or a sequence aligned with rule.hypotheses
+        assigning dependencies[h] replaces one premise
     substitution: the substitution that transforms the rule's consequent and hypotheses into the conclusion and dependencies
-    disjoint: the set of disjoint variable requirements inherited from dependencies
+        derived on demand from the floating premises unless one was provided
+    disjoint: the disjoint variable requirements inherited from dependencies, as (u_mask, v_mask) pairs (see missing_disjoint)
+    variables: bitmask of the variables in the conclusion (see variable_mask), or None if not known
     """
-    def __init__(self, conclusion, rule, dependencies=None, substitution=None, disjoint=None):
+    __slots__ = ("conclusion", "rule", "premises", "_substitution", "disjoint", "variables", "_normal_proof")
+
+    def __init__(self, conclusion, rule, dependencies=None, substitution=None, disjoint=None, variables=None):
 
         # defaults
-        if dependencies is None: dependencies = {}
-        if substitution is None: substitution = {}
-        if disjoint is None: disjoint = set()
+        if disjoint is None: disjoint = ()
 
         self.conclusion = conclusion # conclusion of the step
         self.rule = rule # justification for the step
         self.dependencies = dependencies # previous steps it relies on
         self.substitution = substitution # substitution that matches the dependencies
         self.disjoint = disjoint # disjoint requirements inherited from the dependencies
+        self.variables = variables # variables in the conclusion
 
         # cache normal proofs after first construction
         self._normal_proof = None
 
+    @property
+    def dependencies(self):
+        return Dependencies(self)
+
+    @dependencies.setter
+    def dependencies(self, dependencies):
+        if dependencies is None or len(dependencies) == 0:
+            self.premises = ()
+        elif isinstance(dependencies, Mapping):
+            self.premises = tuple(dependencies.get(hyp.label) for hyp in self.rule.hypotheses)
+            if sum(premise is not None for premise in self.premises) < len(dependencies):
+                unknown = set(dependencies) - {hyp.label for hyp in self.rule.hypotheses}
+                raise KeyError(f"{self.rule.consequent.label} has no hypotheses {unknown}")
+        else:
+            self.premises = tuple(dependencies)
+
+    @property
+    def substitution(self):
+        if self._substitution is not None: return self._substitution
+        return {
+            floating.tokens[1]: premise.conclusion[1:]
+            for (floating, premise) in zip(self.rule.floatings, self.premises) if premise is not None}
+
+    @substitution.setter
+    def substitution(self, substitution):
+        # empty substitutions are derived again on demand
+        self._substitution = substitution if substitution else None
+
     def __repr__(self):
-        return f"ProofStep(conclusion=[{self.rule.consequent.label}] {' '.join(self.conclusion)})"
+        return f"ProofStep(conclusion=[{self.rule.consequent.label}] {' '.join(map(str, self.conclusion))})"
 
     def tree_string(self, label="", prefix=""):
-        subst = {key: " ".join(val) for key, val in self.substitution.items()}
-        ts = f"{prefix}[{label} <= {self.rule.consequent.label}] {' '.join(self.conclusion)} {subst}\n"
+        subst = {key: " ".join(map(str, val)) for key, val in self.substitution.items()}
+        ts = f"{prefix}[{label} <= {self.rule.consequent.label}] {' '.join(map(str, self.conclusion))} {subst}\n"
         for lab, dep in self.dependencies.items():
             ts += dep.tree_string(lab, prefix + " ")
         return ts
 
-    # recursively collect all proof steps along the way to this one
+    # collect all proof steps along the way to this one, in depth-first pre-order
     def all_steps(self, explored = None, check_redundancy=False):
 
         # skip duplicated steps
@@ -78,33 +188,107 @@ class ProofStep:
             if check_redundancy:
                 assert self == explored[self.conclusion], "redundant proof steps"
             return []
-        explored[self.conclusion] = self
 
-        steps = [self]
-        for dep in self.dependencies.values():
-            steps.extend(dep.all_steps(explored))
+        # explicit stack instead of recursion, so that deep proofs do not exhaust the python stack
+        steps = []
+        stack = [self]
+        while len(stack) > 0:
+            step = stack.pop()
+            if step.conclusion in explored: continue
+            explored[step.conclusion] = step
+            steps.append(step)
+            stack.extend(premise for premise in reversed(step.premises) if premise is not None)
         return steps
 
-    # recursively build proof label sequence
+    # build proof label sequence
+    # raises ValueError if some step in the proof does not have a premise for every hypothesis of its rule
     def normal_proof(self):
 
         # build proof if not cached
         if self._normal_proof is None:
-            prf = ()
-            for hyp in self.rule.hypotheses:
-                prf += self.dependencies[hyp.label].normal_proof()
-            prf += (self.rule.consequent.label,)
-            self._normal_proof = prf
+
+            # post-order traversal with an explicit stack, appending labels to one list
+            # spans[id(step)]: (start, stop) of the subproof of an already emitted step, copied for repeated steps
+            prf = []
+            spans = {}
+            stack = [self]
+            push, pop, append = stack.append, stack.pop, prf.append
+            while len(stack) > 0:
+                step = pop()
+                if type(step) is tuple:
+                    # all dependencies of the step have been emitted
+                    step, start = step
+                    append(step.rule.consequent.label)
+                    spans[id(step)] = (start, len(prf))
+                    continue
+                hypotheses = step.rule.hypotheses
+                if len(hypotheses) == 0:
+                    append(step.rule.consequent.label)
+                elif id(step) in spans:
+                    start, stop = spans[id(step)]
+                    prf.extend(prf[start:stop])
+                elif step._normal_proof is not None:
+                    prf.extend(step._normal_proof)
+                else:
+                    if len(step.premises) != len(hypotheses) or None in step.premises:
+                        raise ValueError(f"{step.rule.consequent.label}: {len(hypotheses)} hypotheses but premises {step.premises}")
+                    push((step, len(prf)))
+                    stack.extend(reversed(step.premises))
+
+            # only the requested proof is cached, caching every subproof would take quadratic memory
+            self._normal_proof = tuple(prf)
 
         # return proof
         return self._normal_proof
 
+class Dependencies(Mapping):
+    """
+    View of the premises of a proof step as a dict keyed by hypothesis label
+    assigning to a label replaces that premise and clears the cached substitution and normal proof of the step
+    """
+    __slots__ = ("step",)
+
+    def __init__(self, step):
+        self.step = step
+
+    def __getitem__(self, label):
+        for hyp, premise in zip(self.step.rule.hypotheses, self.step.premises):
+            if hyp.label == label and premise is not None: return premise
+        raise KeyError(label)
+
+    def __setitem__(self, label, premise):
+        hypotheses = self.step.rule.hypotheses
+        labels = [hyp.label for hyp in hypotheses]
+        if label not in labels: raise KeyError(f"{self.step.rule.consequent.label} has no hypothesis {label}")
+        premises = list(self.step.premises) + [None] * (len(hypotheses) - len(self.step.premises))
+        premises[labels.index(label)] = premise
+        self.step.premises = tuple(premises)
+        self.step._substitution = None
+        self.step._normal_proof = None
+
+    def __iter__(self):
+        return (hyp.label for (hyp, premise) in zip(self.step.rule.hypotheses, self.step.premises) if premise is not None)
+
+    def __len__(self):
+        return sum(premise is not None for premise in self.step.premises)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+def disjoint_masks(pairs):
+    """
+    converts disjoint requirements from (x, y) variable pairs to the (u_mask, v_mask) pairs of ProofStep.disjoint
+    """
+    if pairs is None: return ()
+    return tuple((variable_mask((u,)), variable_mask((v,))) for (u, v) in sorted(pairs))
 
 def disjoint_variable_check(rule, substitution):
     """
     Check if disjoint variable requirements are satisfied by given rule and substitution
     returns inherited, message
-        inherited: inherited requirements if satisfied, otherwise None
+        inherited: inherited requirements as a set of (x, y) variable pairs if satisfied, otherwise None
+            (see disjoint_masks to store them in a ProofStep)
         mesage: "" if satisfied, otherwise error message
     """
 
@@ -139,11 +323,16 @@ def perform(rule, dependencies):
         return None, f"{len(rule.hypotheses)} hypotheses != {len(dependencies)} dependences"
 
     # form substitution that unifies hypotheses with dependencies
-    substitution = {}
-    for (hypothesis, dependency) in zip(rule.hypotheses, dependencies):
+    # bindings[i] is the substitution for the ith floating hypothesis, in rule.templates slot order
+    # masks[i] is the bitmask of the variables in bindings[i]
+    bindings = []
+    masks = []
+    templates = rule.templates
+    num_floatings = len(rule.floatings)
+    for (h, (hypothesis, dependency)) in enumerate(zip(rule.hypotheses, dependencies)):
 
         # update substitution for floating hypotheses
-        if hypothesis.tag == "$f":
+        if h < num_floatings:
 
             # check matching types
             h_type, d_type = hypothesis.tokens[0], dependency.conclusion[0]
@@ -151,66 +340,84 @@ def perform(rule, dependencies):
                 return None, f"{hypothesis.label}: mismatched types {h_type} vs {d_type}"
 
             # update substitution
-            variable = hypothesis.tokens[1]
-            substitution[variable] = dependency.conclusion[1:]
+            binding = dependency.conclusion[1:]
+            bindings.append(binding)
+            mask = dependency.variables
+            if mask is None: mask = variable_mask(rule.variables.intersection(binding))
+            masks.append(mask)
 
         # check that substitution unifies dependencies with essential hypotheses
         else: #if hypothesis.tag == "$e":
-            substituted = substitute(hypothesis.tokens, substitution)
+            substituted = templates[h - num_floatings].instantiate(bindings)
             if dependency.conclusion != substituted:
-                substr = {k: " ".join(v) for k,v in substitution.items()}
-                return None, f"{hypothesis.label}: {' '.join(dependency.conclusion)} != subst({' '.join(hypothesis.tokens)}, {substr})"
+                substr = {f.tokens[1]: " ".join(map(str, v)) for f, v in zip(rule.floatings, bindings)}
+                return None, f"{hypothesis.label}: {' '.join(map(str, dependency.conclusion))} != subst({' '.join(map(str, hypothesis.tokens))}, {substr})"
 
     # check disjoint variable requirements
-    inherited, message = disjoint_variable_check(rule, substitution)
-    if inherited is None: return None, message
+    inherited = []
+    for (i, j) in rule.disjoint_slots:
+        if masks[i] & masks[j]:
+            u, v = rule.floatings[i].tokens[1], rule.floatings[j].tokens[1]
+            substitution = {f.tokens[1]: v for f, v in zip(rule.floatings, bindings)}
+            return None, f"{rule.consequent.label}: $d {u} {v} violated by {substitution}"
+        if masks[i] and masks[j]: inherited.append((masks[i], masks[j]))
 
     # infer conclusion from the rule
-    conclusion = substitute(rule.consequent.tokens, substitution)
-
-    # wrap dependencies in dictionary by hypothesis label
-    dependencies = {hyp.label: dep for (hyp, dep) in zip(rule.hypotheses, dependencies)}
+    conclusion = templates[-1].instantiate(bindings)
+    variables = 0
+    for slot in templates[-1].slots: variables |= masks[slot]
 
     # return results as a proof step with empty status message
-    result = ProofStep(conclusion, rule, dependencies, substitution, inherited)
+    # the substitution is not stored, it is derived from the floating dependencies when needed
+    result = ProofStep(conclusion, rule, dependencies, None, tuple(inherited), variables)
     return result, ""
 
 # @profile
-def conduct(rule, stack, disjoint=None):
+def conduct(rule, stack, disjoint=None, store=None):
     """
     Conduct one step of a proof
     Applies given rule to top of stack; pops top of stack in place
     asserts disjoint variable requirements if provided
+    store: optional stepstore.StepStore, the step is shared with earlier applications of rule to the same dependencies
     Returns the resulting proof step object and status message
     If step is unsound, proof steps is None, otherwise message is ""
     """
 
     # short-circuit hypothesis-less rules
     if len(rule.hypotheses) == 0:
-        return ProofStep(tuple(rule.consequent.tokens), rule), ""
+        if store is None: return ProofStep(tuple(rule.consequent.tokens), rule, variables=hypothesis_mask(rule)), ""
+        step, key = store.get(rule, ())
+        if step is None: step = store.add(key, ProofStep(tuple(rule.consequent.tokens), rule, variables=hypothesis_mask(rule)))
+        return step, ""
 
     # pop top of stack
     split = len(stack) - len(rule.hypotheses)
     dependencies = stack[split:]
     del stack[split:]
 
-    # get next proof step by applying rule to top of stack
+    # get next proof step by applying rule to top of stack, unless already stored
     # conclusion, substitution, disjoint = perform(rule, dependencies)
-    step, msg = perform(rule, dependencies)
-    if step is None: return step, msg
+    step = None
+    if store is not None: step, key = store.get(rule, dependencies)
+    if step is None:
+        step, msg = perform(rule, dependencies)
+        if step is None: return step, msg
+        if store is not None: step = store.add(key, step)
 
     # check against missing disjoint requirements
-    if disjoint is not None:
-        if step.disjoint > disjoint:
-            return None, f"missing $d requirements: {step.disjoint} - {disjoint} = {step.disjoint - disjoint}"
+    if disjoint is not None and len(step.disjoint) > 0:
+        missing = missing_disjoint(step.disjoint, disjoint_partners(frozenset(disjoint)))
+        if len(missing) > 0:
+            return None, f"missing $d requirements: {missing}"
 
     # return resulting proof step and normal status
     return step, ""
 
 # @profile
-def verify_normal_proof(database, claim):
+def verify_normal_proof(database, claim, store=None):
     """
     claim: a rule object whose proof will be verified
+    store: optional stepstore.StepStore shared between claims
     returns root of proof tree and dictionary of proof step nodes
     raises error if proof invalid
     """
@@ -229,7 +436,7 @@ def verify_normal_proof(database, claim):
 
         # conduct next proof step
         rule = database.rules[step_label]
-        proof_step, msg = conduct(rule, stack, claim.disjoint)
+        proof_step, msg = conduct(rule, stack, claim.disjoint, store)
         assert msg == "", msg
         conclusion = proof_step.conclusion
 
@@ -243,37 +450,61 @@ def verify_normal_proof(database, claim):
     # check that original claim has been proved
     assert len(stack) == 1, f"non-singleton stack {stack} after proof"
     assert stack[0].conclusion == tuple(claim.consequent.tokens), \
-           f"proved statement {' '.join(stack[0].conclusion)} does not match theorem {' '.join(claim.consequent.tokens)}"
+           f"proved statement {' '.join(map(str, stack[0].conclusion))} does not match theorem {' '.join(map(str, claim.consequent.tokens))}"
 
     # return root of proof graph and dictionary of nodes
     return stack[0], proof_steps
 
+# byte table from compressed proof letters to digit values: A-T -> 0-19, U-Y -> 20-24, Z -> 25, anything else -> 255
+STEP_DIGITS = bytearray(b"\xff" * 256)
+for n, letter in enumerate(b"ABCDEFGHIJKLMNOPQRSTUVWXYZ"): STEP_DIGITS[letter] = n
+STEP_DIGITS = bytes(STEP_DIGITS)
+
+def decode_pointers(proof_string):
+    """
+    converts the mixed-radix letters of a compressed proof to integer step pointers
+    letters are mapped to digit values in bulk with STEP_DIGITS before the loop that combines them
+    returns list of pointers, with -1 wherever a Z tags the previous step
+    raises ValueError if the string contains other characters or ends in the middle of a pointer
+    """
+    step_pointers = []
+    append = step_pointers.append
+    pointer = 0
+    for digit in proof_string.encode("latin-1", "replace").translate(STEP_DIGITS):
+        if digit < 20:
+            append(20 * pointer + digit)
+            pointer = 0
+        elif digit < 25:
+            pointer = 5 * pointer + digit - 19
+        elif digit == 25:
+            append(-1) # indicates previous step should be tagged
+        else:
+            raise ValueError(f"invalid character in compressed proof string {proof_string}")
+    if pointer != 0: raise ValueError(f"unterminated pointer at end of compressed proof string {proof_string}")
+    return step_pointers
+
+def decode_compressed(proof):
+    """
+    proof: token list of a compressed proof, starting with "("
+    returns (step_labels, step_pointers)
+        step_labels: the labels listed between the parentheses
+        step_pointers: the decoded steps (see decode_pointers)
+            pointers index into the claim's hypotheses, followed by step_labels, followed by the tagged steps
+    """
+    split = proof.index(")")
+    return proof[1:split], decode_pointers(''.join(proof[split+1:])) # join in case of newlines
+
 # @profile
-def verify_compressed_proof(database, claim):
+def verify_compressed_proof(database, claim, store=None):
     """
     claim: a rule object whose proof will be verified
+    store: optional stepstore.StepStore shared between claims
     returns root of proof tree and dictionary of proof step nodes
     raises error if proof invalid
     """
 
-    # extract labels and mixed-radix pointer encodings
-    split = claim.consequent.proof.index(")")
-    step_labels = claim.consequent.proof[1:split]
-    proof_string = ''.join(claim.consequent.proof[split+1:]) # join in case of newlines
-
-    # convert to integer pointers and save tagged steps
-    A, U, Z = ord('A'), ord('U'), ord('Z')
-    step_pointers = []
-    pointer = 0
-    for ordinal in map(ord, proof_string):
-        if ordinal < U:
-            pointer = 20 * pointer + (ordinal - A)
-            step_pointers.append(pointer)
-            pointer = 0
-        elif ordinal < Z:
-            pointer = 5 * pointer + (ordinal - U) + 1
-        else:
-            step_pointers.append(-1) # indicates previous step should be tagged
+    # extract labels and convert mixed-radix encodings to integer pointers
+    step_labels, step_pointers = decode_compressed(claim.consequent.proof)
 
     # initialize proof stack
     stack = []
@@ -284,8 +515,12 @@ def verify_compressed_proof(database, claim):
     # steps for claim hypotheses
     for hypothesis in claim.hypotheses:
         conclusion, rule = tuple(hypothesis.tokens), database.rules[hypothesis.label]
-        proof_steps.append(ProofStep(conclusion, rule))
-        proof_step_dict[conclusion] = proof_steps[-1]
+        proof_step, key = (None, None) if store is None else store.get(rule, ())
+        if proof_step is None:
+            proof_step = ProofStep(conclusion, rule, variables=hypothesis_mask(rule, claim.variables))
+            if store is not None: proof_step = store.add(key, proof_step)
+        proof_steps.append(proof_step)
+        proof_step_dict[proof_step.conclusion] = proof_step
     # step labels
     proof_steps += step_labels
 
@@ -303,7 +538,7 @@ def verify_compressed_proof(database, claim):
 
             # replace labels by associated step
             if type(proof_step) is str:
-                proof_step, msg = conduct(database.rules[proof_step], stack, claim.disjoint)
+                proof_step, msg = conduct(database.rules[proof_step], stack, claim.disjoint, store)
                 assert msg == "", msg
                 proof_step_dict[proof_step.conclusion] = proof_step
 
@@ -312,22 +547,32 @@ def verify_compressed_proof(database, claim):
 
     # check that original claim has been proved
     assert stack[0].conclusion == tuple(claim.consequent.tokens), \
-           f"proved statement {' '.join(stack[0].conclusion)} does not match theorem {' '.join(claim.consequent.tokens)}"
+           f"proved statement {' '.join(map(str, stack[0].conclusion))} does not match theorem {' '.join(map(str, claim.consequent.tokens))}"
     assert len(stack) == 1, f"non-singleton stack {stack} after proof"
 
     # return root of proof graph and dictionary of nodes
     return stack[0], proof_step_dict
 
-def verify_proof(database, claim):
+def verify_proof(database, claim, store=None):
     # compressed proofs start with "(" token
+    # steps are shared with other claims through store (a stepstore.StepStore) if provided
     if claim.consequent.proof[0] == "(":
-        return verify_compressed_proof(database, claim)
+        return verify_compressed_proof(database, claim, store)
     else:
-        return verify_normal_proof(database, claim)
+        return verify_normal_proof(database, claim, store)
 
 # @profile
-def verify_all(database, start=0, stop=-1):
+def verify_all(database, start=0, stop=-1, processes=1, cache=None):
     # verify all claims in the database
+    # with a verifycache.VerificationCache, unchanged claims that passed before are skipped and the cache is saved at the end
+    if processes > 1 or cache is not None:
+        try:
+            for label, ok, message in verify_each(database, start, stop, processes, cache=cache):
+                assert ok, f"{label}: {message}"
+        finally:
+            if cache is not None: cache.save()
+        return
+
     for c, claim in enumerate(database.rules.values()):
 
         # only in specified slice
@@ -338,11 +583,237 @@ def verify_all(database, start=0, stop=-1):
         if claim.consequent.tag != "$p": continue
         # print(c, claim.consequent.label)
 
-        verify_proof(database, claim)
+        # only the status is needed, so skip building the proof tree
+        message = check_proof(database, claim)
+        assert message == "", f"{claim.consequent.label}: {message}"
+
+def check_step(rule, stack, claim, bindings):
+    """
+    verify-only version of conduct over bare conclusions (token tuples) instead of ProofSteps
+    applies rule to top of stack in place and checks disjoint variable requirements against claim
+    bindings: scratch list reused between steps
+    returns "" if the step is sound, otherwise an error message
+    """
+    hypotheses = rule.hypotheses
+
+    # short-circuit hypothesis-less rules
+    if len(hypotheses) == 0:
+        stack.append(rule.consequent.tokens)
+        return ""
+
+    split = len(stack) - len(hypotheses)
+    if split < 0:
+        return f"{rule.consequent.label}: {len(hypotheses)} hypotheses != {len(stack)} dependences"
+
+    # form substitution that unifies hypotheses with the top of the stack
+    bindings.clear()
+    templates = rule.templates
+    num_floatings = len(rule.floatings)
+    for h, conclusion in enumerate(stack[split:]):
+        hypothesis = hypotheses[h]
+        if h < num_floatings:
+            if hypothesis.tokens[0] != conclusion[0]:
+                return f"{hypothesis.label}: mismatched types {hypothesis.tokens[0]} vs {conclusion[0]}"
+            bindings.append(conclusion[1:])
+        elif conclusion != templates[h - num_floatings].instantiate(bindings):
+            return f"{hypothesis.label}: {' '.join(map(str, conclusion))} != subst({' '.join(map(str, hypothesis.tokens))})"
+
+    # substituted variables must stay disjoint and be disjoint in the claim
+    # variable masks are only needed for the (few) rules with $d requirements, so they are not tracked on the stack
+    if len(rule.disjoint_slots) > 0:
+        masks = [variable_mask(claim.variables.intersection(binding)) for binding in bindings]
+        for (i, j) in rule.disjoint_slots:
+            u_mask, v_mask = masks[i], masks[j]
+            if u_mask & v_mask:
+                u, v = rule.floatings[i].tokens[1], rule.floatings[j].tokens[1]
+                return f"{rule.consequent.label}: $d {u} {v} violated by shared variables {mask_variables(u_mask & v_mask)}"
+            if u_mask and v_mask:
+                missing = missing_disjoint(((u_mask, v_mask),), disjoint_partners(frozenset(claim.disjoint)))
+                if len(missing) > 0: return f"{rule.consequent.label}: missing $d requirements {missing}"
+
+    # replace dependencies by the substituted consequent
+    del stack[split:]
+    stack.append(templates[-1].instantiate(bindings))
+    return ""
+
+def check_proof(database, claim):
+    """
+    verify-only fast path: runs the proof stack machine without building a proof tree
+    returns "" if the proof of claim is valid, otherwise an error message
+    """
+    stack, bindings = [], []
+    proof = claim.consequent.proof
+    rules = database.rules
+
+    # normal proofs apply each label in turn
+    if len(proof) == 0 or proof[0] != "(":
+        for label in proof:
+            if label not in rules: return f"unknown label {label}"
+            message = check_step(rules[label], stack, claim, bindings)
+            if message != "": return message
+
+    # compressed proofs dereference pointers into hypotheses, labels and tagged conclusions
+    else:
+        try:
+            step_labels, step_pointers = decode_compressed(proof)
+        except ValueError as error:
+            return str(error)
+        steps = [hypothesis.tokens for hypothesis in claim.hypotheses]
+        for label in step_labels:
+            if label not in rules: return f"unknown label {label}"
+            steps.append(rules[label])
+        for pointer in step_pointers:
+            if pointer < 0:
+                if len(stack) == 0: return "tag before first step"
+                steps.append(stack[-1])
+            elif pointer >= len(steps):
+                return f"step pointer {pointer} out of range"
+            elif type(steps[pointer]) is tuple:
+                stack.append(steps[pointer])
+            else:
+                message = check_step(steps[pointer], stack, claim, bindings)
+                if message != "": return message
+
+    # check that original claim has been proved
+    if len(stack) != 1: return f"stack of size {len(stack)} after proof"
+    if stack[0] != claim.consequent.tokens:
+        return f"proved statement {' '.join(map(str, stack[0]))} does not match theorem {' '.join(map(str, claim.consequent.tokens))}"
+    return ""
+
+def verify_claim(database, claim):
+    """
+    verify one claim without raising
+    returns (label, ok, message): ok is False and message explains why if the proof is invalid
+    """
+    label = claim.consequent.label
+    try:
+        message = check_proof(database, claim)
+    except (KeyError, IndexError, ValueError) as error:
+        message = f"{type(error).__name__}: {error}"
+    return label, message == "", message
+
+# database being verified, set in each worker process of a parallel verification
+_worker_database = None
+
+def _init_verify_worker(database):
+    # with fork, the database is inherited copy-on-write instead of pickled
+    global _worker_database
+    _worker_database = database
 
-def normal_to_compressed():
-    # or do this as post processing in mm?
-    raise NotImplementedError
+def _verify_label(label):
+    return verify_claim(_worker_database, _worker_database.rules[label])
+
+def verify_each(database, start=0, stop=-1, processes=1, chunksize=16, cache=None, labels=None):
+    """
+    verify all $p claims in the specified slice of the database rules, like verify_all but without raising
+    yields (label, ok, message) for each claim in rule order, as soon as it is verified
+    labels: if provided, verify the claims with these labels (in the given order) instead of the slice
+    if processes > 1, claims are verified by a pool of worker processes that each receive the database once
+    cache: optional verifycache.VerificationCache
+        claims that it has recorded as verified (with an unchanged key) are reported ok without checking
+        all other results are recorded in it, call cache.save() to persist them
+    """
+    if labels is None:
+        labels = []
+        for c, (label, claim) in enumerate(database.rules.items()):
+            if c < start: continue
+            if c == stop: break
+            if claim.consequent.tag == "$p": labels.append(label)
+
+    pending = [label for label in labels if cache is None or not cache.is_verified(database, database.rules[label])]
+
+    def merged(results):
+        # interleave fresh results with the cached ones, in rule order
+        verified = set(labels) - set(pending)
+        for label in labels:
+            if label in verified:
+                yield label, True, ""
+                continue
+            result = next(results)
+            if cache is not None: cache.record(database, database.rules[label], result[1])
+            yield result
+
+    if processes == 1:
+        yield from merged(verify_claim(database, database.rules[label]) for label in pending)
+        return
+
+    import multiprocessing as mp
+    with mp.Pool(processes, initializer=_init_verify_worker, initargs=(database,)) as pool:
+        yield from merged(pool.imap(_verify_label, pending, chunksize))
+
+def encode_pointer(pointer):
+    """
+    converts an integer step pointer to its mixed-radix letters (inverse of decode_pointers)
+    the last letter is A-T for pointer % 20, preceded by bijective base-5 digits U-Y for pointer // 20
+    """
+    letters = [chr(65 + pointer % 20)]
+    pointer //= 20
+    while pointer > 0:
+        pointer -= 1
+        letters.append(chr(85 + pointer % 5))
+        pointer //= 5
+    return "".join(reversed(letters))
+
+def normal_to_compressed(claim, root):
+    """
+    claim: the rule object proved by root
+    root: ProofStep at the root of a proof DAG for claim
+    returns the compressed proof token list: "(", the step labels, ")", and the proof letters
+    steps with the same conclusion are only proved once
+    steps with hypotheses that are used more than once are tagged with Z and referenced again by pointer
+    the claim's mandatory hypotheses are not listed; the other labels are ordered by decreasing number
+        of references (ties by first reference), so the most common steps get the shortest pointers
+    runs in time linear in the number of distinct steps and references (plus conclusion hashing)
+    """
+
+    # first pass: iterative post-order traversal that expands each distinct conclusion once
+    # events[n] = (step, expanded): expanded is False for repeated references to an earlier step
+    # a conclusion only counts as proved once its whole subproof has been emitted, so a step
+    # whose conclusion repeats one of its ancestors is still expanded in full
+    references = {} # conclusion: number of back-references to its proof
+    events = []
+    stack = [(root, False)]
+    while len(stack) > 0:
+        step, done = stack.pop()
+        if done:
+            references.setdefault(step.conclusion, 0)
+            events.append((step, True))
+            continue
+        if step.conclusion in references:
+            references[step.conclusion] += 1
+            events.append((step, False))
+            continue
+        stack.append((step, True))
+        for premise in reversed(step.premises):
+            stack.append((premise, False))
+
+    # count label references, tagged steps are only referenced by label once
+    hypotheses = {hypothesis.label: h for (h, hypothesis) in enumerate(claim.hypotheses)}
+    label_counts = {}
+    for step, expanded in events:
+        label = step.rule.consequent.label
+        if label in hypotheses: continue
+        if expanded or len(step.rule.hypotheses) == 0:
+            label_counts[label] = label_counts.get(label, 0) + 1
+
+    # most used labels first, stable sort keeps first reference order for ties
+    labels = sorted(label_counts, key=label_counts.__getitem__, reverse=True)
+    pointers = dict(hypotheses)
+    pointers.update((label, len(hypotheses) + n) for (n, label) in enumerate(labels))
+
+    # second pass: emit pointers, tagging referenced steps as soon as they are first proved
+    letters = []
+    tags = {}
+    for step, expanded in events:
+        if not expanded and step.conclusion in tags:
+            letters.append(encode_pointer(tags[step.conclusion]))
+            continue
+        letters.append(encode_pointer(pointers[step.rule.consequent.label]))
+        if expanded and references[step.conclusion] > 0 and len(step.rule.hypotheses) > 0 and step.conclusion not in tags:
+            tags[step.conclusion] = len(pointers) + len(tags)
+            letters.append("Z")
+
+    return ["("] + labels + [")", "".join(letters)]
 
 if __name__ == "__main__":
 
@@ -395,6 +866,10 @@ if __name__ == "__main__":
         # print(claim.consequent.proof[:20])
         verify_normal_proof(db, claim)
 
+        # re-compress and verify again
+        claim.consequent = Statement(stmt.label, stmt.tag, stmt.tokens, normal_to_compressed(claim, root))
+        verify_compressed_proof(db, claim)
+
     # # TODO: complete following demonstration of solitaire functionality
 
     # # conduct a proof, one step at a time, for x = x
@@ -1,47 +1,43 @@
 import os
 import src.metamathpy.database as md
 
-def load_imp(fpath = None):
-    # last label before any ax-3 proofs is loowoz
-    print('loading..')
+def cache_dir(fpath):
+    # parsed snapshots are cached next to the source file so repeat loads skip the full parse
+    return os.path.join(os.path.dirname(os.path.abspath(fpath)), ".mmpy_cache")
+
+# full parses already loaded in this process, keyed by file path
+_full_databases = {}
+
+def load_full(fpath = None):
+    """
+    Parse all of fpath once per process (and once per file version with the snapshot cache)
+    The truncated loaders below return prefix views of this shared database
+    """
     if fpath is None:
         fpath = os.path.join(os.environ["HOME"], "metamath", "set.mm")
-    db = md.parse(fpath, last_rule="loowoz")
+    if fpath not in _full_databases:
+        print('loading..')
+        _full_databases[fpath] = md.parse(fpath, cache_dir=cache_dir(fpath))
+    return _full_databases[fpath]
+
+def load_imp(fpath = None):
+    # last label before any ax-3 proofs is loowoz
     # negation wffs and ax-3 not used
-    db.rules.pop("wn")
-    db.rules.pop("ax-3")
-    return db
+    return load_full(fpath).prefix("loowoz", exclude=("wn", "ax-3"))
 
 def load_ni(fpath = None):
     # last label before any new boolean operator definitions is bijust, "rule" 441
-    print('loading..')
-    if fpath is None:
-        fpath = os.path.join(os.environ["HOME"], "metamath", "set.mm")
-    db = md.parse(fpath, last_rule="bijust")
-    return db
+    return load_full(fpath).prefix("bijust")
 
 def load_pl(fpath = None):
-
     # last label before any FOL (universal quantifier) is xorexmid, it is "rule" 2849 (including hypotheses)
-    print('loading..')
-    if fpath is None:
-        fpath = os.path.join(os.environ["HOME"], "metamath", "set.mm")
-    db = md.parse(fpath, last_rule="xorexmid")
-    return db
+    return load_full(fpath).prefix("xorexmid")
 
 def load_all(fpath = None):
-    print('loading..')
-    if fpath is None:
-        fpath = os.path.join(os.environ["HOME"], "metamath", "set.mm")
-    db = md.parse(fpath)
-    return db
+    return load_full(fpath)
 
 def load_to(last_rule, fpath = None):
-    print('loading..')
-    if fpath is None:
-        fpath = os.path.join(os.environ["HOME"], "metamath", "set.mm")
-    db = md.parse(fpath, last_rule=last_rule)
-    return db
+    return load_full(fpath).prefix(last_rule)
 
 def new_usage_discouraged(fpath = None):
     if fpath is None:
@@ -0,0 +1,77 @@
+"""
+Hash-consed store of proof steps shared between the proofs of many theorems
+Run from top-level directory with
+$ python -m src.metamathpy.stepstore
+"""
+from collections import OrderedDict
+
+class StepStore:
+    """
+    Bounded store of ProofSteps keyed by (rule, ids of dependency steps)
+    Applying the same rule to the same dependency objects always gives the same step,
+    so repeated subproofs (e.g. wff constructions) are built once and shared across theorems
+    steps[(rule, ids)]: the shared step, least recently used first
+        stored steps keep their dependencies alive, so the ids in the keys are never reused
+    conclusions[conclusion]: [interned conclusion, number of stored steps that share it]
+    max_steps: the memory budget, least recently used steps are evicted beyond it
+        evicted steps stay valid, they are only no longer shared with later proofs
+    hits, misses: lookup counts
+    """
+    def __init__(self, max_steps=1_000_000):
+        self.max_steps = max_steps
+        self.steps = OrderedDict()
+        self.conclusions = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.steps)
+
+    def get(self, rule, dependencies):
+        """
+        returns (step, key): the stored step for rule applied to dependencies (None if absent)
+        and the key to add it under otherwise
+        """
+        key = (rule, tuple(map(id, dependencies)))
+        step = self.steps.get(key)
+        if step is None:
+            self.misses += 1
+        else:
+            self.steps.move_to_end(key)
+            self.hits += 1
+        return step, key
+
+    def add(self, key, step):
+        """
+        stores step under key (as returned by get), interning its conclusion, and returns it
+        """
+        entry = self.conclusions.get(step.conclusion)
+        if entry is None: entry = self.conclusions[step.conclusion] = [step.conclusion, 0]
+        step.conclusion = entry[0]
+        entry[1] += 1
+        self.steps[key] = step
+
+        while len(self.steps) > self.max_steps:
+            _, evicted = self.steps.popitem(last=False)
+            entry = self.conclusions[evicted.conclusion]
+            entry[1] -= 1
+            if entry[1] == 0: del self.conclusions[evicted.conclusion]
+
+        return step
+
+if __name__ == "__main__":
+
+    import os
+    from time import perf_counter
+    from src.metamathpy.database import parse
+    from src.metamathpy.proof import verify_proof
+
+    fpath = os.path.join(os.environ["HOME"], "metamath", "set.mm")
+    db = parse(fpath)
+    claims = [rule for rule in db.rules.values() if rule.consequent.tag == "$p"]
+
+    for store in (None, StepStore()):
+        start = perf_counter()
+        for claim in claims: verify_proof(db, claim, store)
+        print(f"store={store is not None}: verified {len(claims)} proofs in {perf_counter()-start:.2f}s")
+    print(f"{len(store)} shared steps, {len(store.conclusions)} distinct conclusions, {store.hits} hits, {store.misses} misses")
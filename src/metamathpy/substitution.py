@@ -1,3 +1,5 @@
+from collections.abc import Mapping
+
 try:
     profile
 except NameError:
@@ -11,11 +13,11 @@ def substitute(symbols, substitution):
     substitution[v]: symbol string to put in place of symbol v
     returns result[n]: nth token after substitutions applied
     """
-    result = ()
+    result = []
     for symbol in symbols:
         if symbol in substitution: result += substitution[symbol]
-        else: result += (symbol,)
-    return result
+        else: result.append(symbol)
+    return tuple(result)
 # from substitute import substitute # cython version
 
 def compose(t, s):
@@ -30,39 +32,81 @@ def compose(t, s):
         if k not in s: ts[k] = v
     return ts
 
-def match_helper(vartoks, chunks, tokens, substitution):
+def bracket_limits(tokens, open_bracket="(", close_bracket=")"):
+    """
+    limits[p]: the first position k > p where the bracket depth drops below its depth at p (len(tokens)+1 if none)
+    the span tokens[p:e] is balanced iff e < limits[p] and depths[e] == depths[p]
+    returns (depths, limits), depths[k] is the bracket depth before tokens[k], for k in range(len(tokens)+1)
+    """
+    depths = [0]
+    for token in tokens:
+        depths.append(depths[-1] + (token == open_bracket) - (token == close_bracket))
+    limits = [0] * len(depths)
+    stack = []
+    for k in reversed(range(len(depths))):
+        while len(stack) > 0 and depths[stack[-1]] >= depths[k]: stack.pop()
+        limits[k] = stack[-1] if len(stack) > 0 else len(depths)
+        stack.append(k)
+    return depths, limits
+
+def plan_matcher(plan, tokens, i, p, bindings, brackets):
     """
     recursive helper for Scheme.matches
-    matches the tail of a token string against the tails of a scheme.vartoks[i:] and .chunks[i+1:]
-    schemes have one more chunk than vartok and the leading chunk should be omitted in the top-level call
-    substition should start empty at the top-level call and is populated during the recursion
+    matches tokens[p:] against plan[i:] (see Scheme.plan)
+    bindings is updated in place during the recursion, a copy is yielded for each match
+    brackets: None, or bracket_limits(tokens) if variables can only be bound to balanced spans
     """
 
-    # base case: no chunks left in the tail
-    if len(chunks) == 0:
-        # current substitution works if no tokens left either
-        if len(tokens) == 0: yield substitution
-
-    # otherwise, iterate over each possible position for next chunk
+    # base case: all variables bound, works if no tokens left either
+    if i == len(plan):
+        if p == len(tokens): yield dict(bindings)
+        return
+
+    variable, chunk, reserved = plan[i]
+    n = len(chunk)
+
+    # already bound variables must occur again, followed by the chunk
+    bound = bindings.get(variable)
+    if bound is not None:
+        e = p + len(bound)
+        if tokens[p:e] == bound and tokens[e:e+n] == chunk:
+            yield from plan_matcher(plan, tokens, i+1, e+n, bindings, brackets)
+        return
+
+    # last possible end of the binding, leaving enough tokens for the remaining plan
+    last = len(tokens) - reserved
+    if brackets is not None: last = min(last, brackets[1][p] - 1)
+    if last <= p: return
+
+    # candidate ends: anchored at the end for the last variable, otherwise at occurrences of the chunk
+    if i == len(plan) - 1:
+        ends = (last,) if tokens[last:] == chunk else ()
+    elif n == 0:
+        ends = range(p+1, last+1)
     else:
+        ends = chunk_occurrences(tokens, chunk, p+1, last+1)
 
-        n = len(chunks[0])
-        v = vartoks[0]
-
-        # need to reserve at least this many tokens for tail after vartoks[0]
-        reserved = sum(map(len, chunks)) + len(vartoks)-1
+    for e in ends:
+        if brackets is not None and brackets[0][e] != brackets[0][p]: continue
+        bindings[variable] = tokens[p:e]
+        yield from plan_matcher(plan, tokens, i+1, e+n, bindings, brackets)
+    bindings.pop(variable, None)
 
-        # scan remaining positions
-        for t in range(1, len(tokens)-reserved+1):
-            # check for match and consistent substitution
-            if chunks[0] == tokens[t:t+n] and substitution.get(v, tokens[:t]) == tokens[:t]:
-                next_sub = substitution | {v: tokens[:t]}
-                # recurse on the remaining tails with the new substitution
-                yield from match_helper(vartoks[1:], chunks[1:], tokens[t+n:], next_sub)
+def chunk_occurrences(tokens, chunk, start, stop):
+    """
+    yields the positions e in range(start, stop) where tokens[e:] starts with chunk (chunk is not empty)
+    candidates are located with tuple.index on the first token of chunk
+    """
+    first, n = chunk[0], len(chunk)
+    while True:
+        try: e = tokens.index(first, start, stop)
+        except ValueError: return
+        if n == 1 or tokens[e:e+n] == chunk: yield e
+        start = e + 1
 
 def pile_match_helper(vartoks, chunks, node, varfix, substitution):
     """
-    recursive helper for Scheme.matches
+    recursive helper for Scheme.pile_matches
     matches the tokens under pile trie node against scheme tail zip(vartoks[i:], chunks[i+1:])
     schemes have one more chunk than vartok and the leading chunk should be omitted in the top-level call
     varfix is leading token sequence to be substituted for vartoks[0], start empty and fill during the recursion
@@ -110,6 +154,8 @@ class Scheme:
         tokens == chunks[0] + vartoks[0] + chunks[1] + vartoks[1] + ... + vartoks[n] + chunks[n+1]
     where chunks are constants and vartoks are variable occurrances that can be substituted
     """
+    __slots__ = ("tokens", "variables", "multiplicities", "offsets", "vartoks", "chunks", "_plan")
+
     def __init__(self, tokens, variables):
         self.tokens = tuple(tokens)
         self.variables = tuple(variables)
@@ -117,6 +163,7 @@ class Scheme:
         self.offsets = tuple(t for (t, token) in enumerate(tokens) if token in variables)
         self.vartoks = tuple(self.tokens[t] for t in self.offsets)
         self.chunks = tuple(self.tokens[s+1:t] for (s,t) in zip((-1,)+self.offsets, self.offsets+(len(tokens),)))
+        self._plan = None
 
     def __repr__(self):
         return f"Scheme({' '.join(self.tokens)}, v={self.variables})"
@@ -133,20 +180,42 @@ class Scheme:
             result = result + insertion + chunk
         return result           
 
-    def matches(self, tokens):
+    @property
+    def plan(self):
+        """
+        compiled form of the scheme for matching, computed on first use
+        plan[i] = (vartoks[i], chunks[i+1], reserved)
+            reserved: minimum number of tokens after the binding of vartoks[i] (one per later variable occurrence plus the chunks)
+        """
+        if self._plan is None:
+            plan = []
+            reserved = 0
+            for (variable, chunk) in reversed(tuple(zip(self.vartoks, self.chunks[1:]))):
+                reserved += len(chunk)
+                plan.append((variable, chunk, reserved))
+                reserved += 1
+            self._plan = tuple(reversed(plan))
+        return self._plan
+
+    def matches(self, tokens, balanced=False):
         """
         Generator that yields all substitutions which match this scheme with the given token sequence
-        Wraps the top-level call to match_helper
+        Every variable is bound to a non-empty span, candidate spans are taken from the occurrences of the following chunk
+        if balanced is True, variables are only bound to spans with balanced parentheses
         """
 
         # typecast to tuple if not already
         tokens = tuple(tokens)
 
-        # no matches if prefix chunk does not match
-        if self.chunks[0] != tokens[:len(self.chunks[0])]: return
+        # no matches if prefix chunk does not match or too few tokens are left
+        head = self.chunks[0]
+        if head != tokens[:len(head)]: return
+        plan = self.plan
+        if len(plan) > 0 and len(tokens) < len(head) + plan[0][2] + 1: return
 
         # otherwise initiate recursive helper on remainder
-        yield from match_helper(self.vartoks, self.chunks[1:], tokens[len(self.chunks[0]):], {})
+        brackets = bracket_limits(tokens) if balanced else None
+        yield from plan_matcher(plan, tokens, 0, len(head), {}, brackets)
 
     def pile_matches(self, root):
         """
@@ -170,6 +239,36 @@ class Scheme:
             assert self.substitute(s) == other.substitute(s)
             yield s, v
 
+class Template:
+    """
+    Symbol string precompiled for repeated substitution of a fixed sequence of variables
+    variables[i]: the variable whose binding goes in slot i
+    the symbol string is split into the form
+        tokens == chunks[0] + (variables[slots[0]],) + chunks[1] + ... + (variables[slots[n]],) + chunks[n+1]
+    tokens that are not in variables are treated as constants
+    """
+    __slots__ = ("head", "pieces", "slots")
+
+    def __init__(self, tokens, variables):
+        index = {v: i for (i, v) in enumerate(variables)}
+        offsets = tuple(t for (t, token) in enumerate(tokens) if token in index)
+        chunks = tuple(tuple(tokens[s+1:t]) for (s,t) in zip((-1,)+offsets, offsets+(len(tokens),)))
+        self.head = chunks[0]
+        # (slot, chunk) pairs after the leading chunk
+        self.pieces = tuple((index[tokens[t]], chunk) for (t, chunk) in zip(offsets, chunks[1:]))
+        # distinct slots that occur in the string
+        self.slots = tuple(sorted(set(slot for (slot, _) in self.pieces)))
+
+    def instantiate(self, bindings):
+        """
+        returns the symbol string with variables[i] replaced by bindings[i]
+        """
+        result = list(self.head)
+        for (slot, chunk) in self.pieces:
+            result += bindings[slot]
+            result += chunk
+        return tuple(result)
+
 def standardize(schemes, base="v", start=0):
     """
     Renames scheme variables to {base}{start}, {base}{start+1}, ...
@@ -185,50 +284,152 @@ def standardize(schemes, base="v", start=0):
         standardized.append(Scheme(tokens, variables))
     return standardized, standardizer
 
+class PileIndex(Mapping):
+    """
+    Pile of proof steps (pile[conclusion] = step) indexed by leading tokens, for binding schemes against it
+    Behaves like the wrapped dictionary, which should only be extended through add() once indexed
+    prefixes[k-1][tokens[:k]]: list of (tokens, step) entries of the pile that start with those k tokens, for k <= max_prefix
+        k = 1 groups the pile by typecode, k = 2 by the head constant after the typecode
+    """
+    def __init__(self, pile=None, max_prefix=3):
+        self.pile = {}
+        self.prefixes = tuple({} for _ in range(max_prefix))
+        if pile is not None:
+            for tokens, step in pile.items(): self.add(tokens, step)
+
+    def add(self, tokens, step):
+        tokens = tuple(tokens)
+        if tokens in self.pile: return
+        self.pile[tokens] = step
+        for k, index in enumerate(self.prefixes[:len(tokens)]):
+            index.setdefault(tokens[:k+1], []).append((tokens, step))
+
+    def __getitem__(self, tokens):
+        return self.pile[tuple(tokens)]
+
+    def __contains__(self, tokens):
+        return tuple(tokens) in self.pile
+
+    def __iter__(self):
+        return iter(self.pile)
+
+    def __len__(self):
+        return len(self.pile)
+
+    def candidates(self, scheme):
+        """
+        returns the (tokens, step) entries of the pile that scheme can match, as far as its leading chunk tells
+        schemes without variables are looked up directly
+        schemes that start with a variable get a live view of the whole pile rather than a copy
+        """
+        if len(scheme.vartoks) == 0:
+            step = self.pile.get(scheme.tokens)
+            return () if step is None else ((scheme.tokens, step),)
+        head = scheme.chunks[0]
+        if len(head) == 0: return self.pile.items()
+        k = min(len(head), len(self.prefixes))
+        return self.prefixes[k-1].get(head[:k], ())
+
 def multibinder(schemes, pile):
     # yield every substitution s such that all(scheme.sub(s) in pile.keys for scheme in schemes)
-    # also yields the corresponding steps in the pile
+    # also yields the corresponding steps in the pile, in the same order as schemes
+    # pile can be a dictionary or a PileIndex (pass an index to reuse it between calls)
+    if not isinstance(pile, PileIndex): pile = PileIndex(pile)
+    yield from index_binder(tuple(schemes), pile)
+
+def index_binder(schemes, pile):
+    # recursive helper for multibinder, binds the scheme with the fewest candidates in the pile first
 
-    # try matching first scheme against each token sequence in the pile
-    for tokens, step in pile.items():
-        for bindings in schemes[0].matches(tokens):
+    # choose most selective scheme
+    candidates = [pile.candidates(scheme) for scheme in schemes]
+    first = min(range(len(schemes)), key=lambda i: len(candidates[i]))
+    rest = schemes[:first] + schemes[first+1:]
+
+    # try matching it against each compatible token sequence in the pile
+    for tokens, step in candidates[first]:
+        for bindings in schemes[first].matches(tokens):
 
             # base case: this is the last scheme, so done
-            if len(schemes) == 1:
+            if len(rest) == 0:
                 yield bindings, (step,)
                 continue
 
             # recursive case: check if these bindings also work for remaining schemes
             sub_schemes = []
-            for scheme in schemes[1:]:
+            for scheme in rest:
                 sub_schemes.append(Scheme(
                     scheme.substitute(bindings),
                     set(scheme.variables) - set(bindings.keys())
                 ))
 
-            for sub_bindings, steps in multibinder(sub_schemes, pile):
-                yield (bindings | sub_bindings), ((step,) + steps)
+            for sub_bindings, steps in index_binder(tuple(sub_schemes), pile):
+                yield (bindings | sub_bindings), (steps[:first] + (step,) + steps[first:])
 
 def pilebinder(schemes, pile_trie_root):
     # like multibinder but with a pile trie data structure
+    # also yields the corresponding steps in the pile, in the same order as schemes
+    yield from trie_binder(tuple(schemes), pile_trie_root, {})
+
+def bound_prefix(scheme, root, bindings):
+    """
+    traverses the pile trie along the leading tokens of scheme that are known under bindings
+    returns (node, i): the trie node reached and the index of the first unbound variable occurrence in scheme.vartoks
+    node is None if no step in the pile starts with those tokens
+    """
+    node = root.traverse(scheme.chunks[0])
+    for i, (variable, chunk) in enumerate(zip(scheme.vartoks, scheme.chunks[1:])):
+        if node is None or variable not in bindings: return node, i
+        node = node.traverse(bindings[variable] + chunk)
+    return node, len(scheme.vartoks)
+
+def join_cost(schemes, plans, s):
+    """
+    estimated cost of joining scheme s next in trie_binder, with plans as computed there
+    matching s walks the pile steps that start with its known leading tokens (node.count of them),
+        and each unbound variable nests another walk below the tokens matched so far
+    every match is then joined with each other scheme t:
+        a single lookup if s binds the first unbound variable of t (or t is already fully bound),
+        since the rest of t's walk starts from a known prefix
+        otherwise another walk through all node.count steps under t's current prefix
+    so a bare "|- v0" goes before "|- ( v0 -> v1 )": each of its matches turns the implication into a prefix lookup
+    """
+    node, i, unbound = plans[s]
+    cost = 4 ** len(unbound)
+    for t, (t_node, t_i, _) in enumerate(plans):
+        if t == s: continue
+        if t_i == len(schemes[t].vartoks) or schemes[t].vartoks[t_i] in unbound: cost += 1
+        else: cost += t_node.count
+    return node.count * cost
+
+def trie_binder(schemes, root, bindings):
+    """
+    recursive helper for pilebinder, yields (bindings, steps) pairs extending the given bindings
+    on every call the remaining scheme with the smallest estimated cost is joined next, see join_cost
+    schemes are matched under the current bindings instead of being rebuilt with them substituted
+    """
+
+    # plan the next join, stopping early if some scheme has no candidates at all
+    # plans[s] = (node, i, unbound): trie node reached by scheme s, index of its first unbound vartok, and its unbound variables
+    plans = []
+    for scheme in schemes:
+        node, i = bound_prefix(scheme, root, bindings)
+        if node is None or node.count == 0: return
+        plans.append((node, i, set(scheme.vartoks[i:]) - bindings.keys()))
+    first = min(range(len(schemes)), key=lambda s: join_cost(schemes, plans, s))
+    node, i, _ = plans[first]
+    scheme, rest = schemes[first], schemes[:first] + schemes[first+1:]
 
-    for (bindings, step) in schemes[0].pile_matches(pile_trie_root):
+    # match the remaining tail of the scheme below the node reached so far
+    for (substitution, step) in pile_match_helper(scheme.vartoks[i:], scheme.chunks[i+1:], node, (), bindings):
 
         # base case: this is the last scheme, so done
-        if len(schemes) == 1:
-            yield bindings, (step,)
+        if len(rest) == 0:
+            yield substitution, (step,)
             continue
 
         # recursive case: check if these bindings also work for remaining schemes
-        sub_schemes = []
-        for scheme in schemes[1:]:
-            sub_schemes.append(Scheme(
-                scheme.substitute(bindings),
-                set(scheme.variables) - set(bindings.keys())
-            ))
-
-        for sub_bindings, steps in pilebinder(sub_schemes, pile_trie_root):
-            yield (bindings | sub_bindings), ((step,) + steps)
+        for full_bindings, steps in trie_binder(rest, root, substitution):
+            yield full_bindings, (steps[:first] + (step,) + steps[first:])
 
 def unify_words(xt, yt, vts, xh=(), yh=(), u=0, max_depth=-1, s=None, prefix=None):
     """
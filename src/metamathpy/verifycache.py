@@ -0,0 +1,108 @@
+"""
+Persistent cache of verified theorems, so that unchanged proofs are not checked again
+Run from top-level directory with
+$ python -m src.metamathpy.verifycache
+"""
+import hashlib
+import os
+import pickle as pk
+
+# bump whenever the key layout changes
+CACHE_VERSION = 1
+
+def digest(*parts):
+    return hashlib.blake2b(repr(parts).encode(), digest_size=16).digest()
+
+def frame_digest(rule):
+    """
+    digest of everything about rule that matters when it is used as a step in another proof:
+    its consequent, its hypotheses in order, and the $d pairs between its mandatory variables
+    """
+    mandatory = {f.tokens[1] for f in rule.floatings}
+    return digest(
+        rule.consequent.tag, tuple(rule.consequent.tokens),
+        tuple((h.label, h.tag, tuple(h.tokens)) for h in rule.hypotheses),
+        sorted((u, v) for (u, v) in rule.disjoint if u in mandatory and v in mandatory))
+
+def referenced_labels(claim):
+    """
+    returns the set of labels that the proof of claim refers to
+    """
+    proof = claim.consequent.proof
+    if len(proof) > 0 and proof[0] == "(":
+        return set(proof[1:proof.index(")")]) | {h.label for h in claim.hypotheses}
+    return set(proof)
+
+class VerificationCache:
+    """
+    Record of the theorems that passed verification, persisted at path if provided
+    entries[label]: key of the claim when it last passed (see VerificationCache.key)
+    The key covers the claim's statement, hypotheses, variables, $d pairs and proof,
+    and the frame_digest of every rule that the proof references
+    so an entry only matches if nothing that could change the verification result has been edited
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self.entries = {}
+        self._frames = {} # id(rule): (rule, frame_digest(rule)), rule kept so that ids are not reused
+        if path is not None:
+            try:
+                with open(path, "rb") as f: version, entries = pk.load(f)
+                if version == CACHE_VERSION: self.entries = entries
+            except (OSError, EOFError, pk.UnpicklingError, AttributeError, ImportError, ValueError):
+                pass
+
+    def frame(self, rule):
+        if id(rule) not in self._frames:
+            self._frames[id(rule)] = (rule, frame_digest(rule))
+        return self._frames[id(rule)][1]
+
+    def key(self, database, claim):
+        references = tuple(
+            (label, self.frame(database.rules[label]) if label in database.rules else None)
+            for label in sorted(referenced_labels(claim)))
+        return digest(
+            self.frame(claim), tuple(claim.consequent.proof),
+            sorted(claim.variables), sorted(claim.disjoint), references)
+
+    def is_verified(self, database, claim):
+        """
+        returns True if claim passed verification before and nothing it depends on has changed since
+        """
+        return self.entries.get(claim.consequent.label) == self.key(database, claim)
+
+    def record(self, database, claim, ok):
+        """
+        records the verification result of claim
+        """
+        if ok: self.entries[claim.consequent.label] = self.key(database, claim)
+        else: self.entries.pop(claim.consequent.label, None)
+
+    def save(self):
+        """
+        atomically pickle the entries at path, if any
+        """
+        if self.path is None: return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f: pk.dump((CACHE_VERSION, self.entries), f, protocol=pk.HIGHEST_PROTOCOL)
+        os.replace(tmp, self.path)
+
+def cache_path(fpath, cache_dir):
+    stem = os.path.splitext(os.path.basename(fpath))[0]
+    return os.path.join(cache_dir, f"{stem}.verified.pkl")
+
+if __name__ == "__main__":
+
+    from time import perf_counter
+    from src.metamathpy.database import parse
+    from src.metamathpy.proof import verify_all
+
+    fpath = os.path.join(os.environ["HOME"], "metamath", "set.mm")
+    cache_dir = os.path.join(os.environ["HOME"], "metamath", ".mmpy_cache")
+    db = parse(fpath, cache_dir=cache_dir)
+
+    cache = VerificationCache(cache_path(fpath, cache_dir))
+    start = perf_counter()
+    verify_all(db, cache=cache)
+    print(f"verified in {perf_counter()-start:.2f}s ({len(cache.entries)} theorems cached)")
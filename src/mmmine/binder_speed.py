@@ -0,0 +1,54 @@
+# run from mmpy with $ python -m src.mmmine.binder_speed [pile size] [seed]
+"""
+Speed benchmark for binding premise schemes against a pile of proved steps
+Times pilebinder (pile trie, joins planned by substitution.join_cost) and multibinder (prefix index)
+on a random pile of implication/negation theorems, for common premise shapes
+Both binders should report the same number of results for every shape
+"""
+import random
+import sys
+from time import perf_counter
+from ..metamathpy.substitution import Scheme, multibinder, pilebinder, PileIndex
+from ..metamathpy.piletrie import trieify
+
+# premise shapes, as lists of hypotheses over the variables v0, v1, v2
+SHAPES = {
+    "ax-mp": ["|- v0", "|- ( v0 -> v1 )"],
+    "ax-mp reversed": ["|- ( v0 -> v1 )", "|- v0"],
+    "syl": ["|- ( v0 -> v1 )", "|- ( v1 -> v2 )"],
+    "mpd": ["|- ( v0 -> ( v1 -> v2 ) )", "|- ( v0 -> v1 )"],
+    "three premises": ["|- v0", "|- ( v2 -> v0 )", "|- ( v0 -> v1 )"],
+}
+
+def random_wff(depth):
+    if depth == 0 or random.random() < 0.3: return [random.choice(["ph", "ps", "ch"])]
+    if random.random() < 0.3: return ["-."] + random_wff(depth - 1)
+    return ["("] + random_wff(depth - 1) + ["->"] + random_wff(depth - 1) + [")"]
+
+def random_pile(size, depth=4):
+    """
+    pile[tokens] = tokens for size distinct random theorems "|- wff" up to given nesting depth
+    """
+    pile = {}
+    while len(pile) < size:
+        tokens = tuple(["|-"] + random_wff(depth))
+        pile[tokens] = tokens
+    return pile
+
+if __name__ == "__main__":
+
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 3200
+    random.seed(int(sys.argv[2]) if len(sys.argv) > 2 else 0)
+
+    pile = random_pile(size)
+    root, index = trieify(pile), PileIndex(pile)
+    print(f"pile of {len(pile)} steps")
+
+    for name, hypotheses in SHAPES.items():
+        schemes = [Scheme(tuple(hyp.split()), tuple(v for v in ("v0", "v1", "v2") if v in hyp.split())) for hyp in hypotheses]
+        timings = []
+        for binder, pile_arg in ((pilebinder, root), (multibinder, index)):
+            start = perf_counter()
+            count = sum(1 for _ in binder(schemes, pile_arg))
+            timings.append(f"{binder.__name__} {perf_counter()-start:.2f}s ({count} results)")
+        print(f"{name:>16}: " + ", ".join(timings))
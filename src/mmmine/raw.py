@@ -8,6 +8,7 @@ from time import perf_counter
 from ..metamathpy import database as md
 from ..metamathpy import proof as mp
 from ..metamathpy import setmm as ms
+from ..metamathpy.stepstore import StepStore
 
 # proof length and size (uncompressed)
 def proof_metrics(root):
@@ -48,9 +49,10 @@ if __name__ == "__main__":
 
     # get all wff variable labels actually appearing in proofs, in case different
     wff_vars = {} # label: rule
+    store = StepStore() # share subproofs between theorems
     for r, (label, rule) in enumerate(db.rules.items()):
         if rule.consequent.tag == "$p":
-            root, _ = mp.verify_proof(db, rule)
+            root, _ = mp.verify_proof(db, rule, store)
             labels = set(wff_labels.keys()) & set(root.normal_proof())
             for label in labels:
                 wff_vars[label] = db.rules[label]
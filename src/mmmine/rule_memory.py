@@ -0,0 +1,81 @@
+# run from mmpy with $ python -m src.mmmine.rule_memory [path/to/file.mm]
+"""
+Memory benchmark for the parsed database representation
+Compares the compact objects (slotted Rule/Scheme, hypothesis statements shared between rules)
+with an equivalent copy in the original layout (per-instance __dict__, per-rule statement copies)
+"""
+import sys
+from ..metamathpy import database as md
+from ..metamathpy import setmm as ms
+
+def deep_size(roots, skip=()):
+    """
+    total bytes of all objects reachable from roots, counting shared objects once
+    classes and functions are not followed, nor instances of the types in skip
+    """
+    seen = set()
+    total = 0
+    stack = list(roots)
+    while len(stack) > 0:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, type) or isinstance(obj, skip): continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (tuple, list, set, frozenset)):
+            stack.extend(obj)
+        else:
+            if hasattr(obj, "__dict__"): stack.append(vars(obj))
+            for cls in type(obj).__mro__:
+                for slot in getattr(cls, "__slots__", ()):
+                    if hasattr(obj, slot): stack.append(getattr(obj, slot))
+
+    return total
+
+class DictObject:
+    # stand-in for the original dict-backed Rule and Scheme instances
+    def __init__(self, **attributes):
+        self.__dict__.update(attributes)
+
+def legacy_copy(db):
+    """
+    copy of db in the original layout:
+    statements with list tokens, rules and schemes with __dict__, hypotheses copied into every rule
+    """
+    def copy(statement): return md.Statement(statement.label, statement.tag, tuple(list(statement.tokens)), statement.proof)
+
+    statements = {label: md.Statement(s.label, s.tag, list(s.tokens), s.proof) for (label, s) in db.statements.items()}
+    rules = {}
+    for label, rule in db.rules.items():
+        floatings = tuple(map(copy, rule.floatings))
+        essentials = tuple(map(copy, rule.essentials))
+        consequent = copy(rule.consequent)
+        scheme = rule.scheme
+        rules[label] = DictObject(
+            consequent = consequent,
+            essentials = essentials,
+            floatings = floatings,
+            disjoint = set(rule.disjoint),
+            variables = set(rule.variables),
+            hypotheses = floatings + essentials,
+            mandatory = {f.tokens[1]: f.tokens[0] for f in floatings},
+            scheme = DictObject(**{slot: getattr(scheme, slot) for slot in type(scheme).__slots__}),
+        )
+    return statements, rules
+
+if __name__ == "__main__":
+
+    if len(sys.argv) > 1:
+        db = md.parse(sys.argv[1])
+    else:
+        db = ms.load_all()
+
+    compact = deep_size([db.statements, db.rules])
+    legacy = deep_size(legacy_copy(db))
+
+    print(f"{len(db.rules)} rules, {len(db.statements)} statements")
+    print(f"original layout: {legacy / 2**20:.1f} MiB")
+    print(f"compact layout:  {compact / 2**20:.1f} MiB ({100 * compact / legacy:.0f}%)")
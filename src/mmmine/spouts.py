@@ -415,10 +415,12 @@ class Spout:
         # complete dependencies
         for h, d in step.dependencies.items(): self.complete_floating(d, steps)
         # complete step
+        # (read the substitution up front, assigning a dependency clears it)
+        substitution = step.substitution
         for f in step.rule.floatings:
             v = f.tokens[1]
-            # wff = step.substitution[v]
-            wff = step.substitution.get(v, (v,)) # some wvs dont make it into substitution
+            # wff = substitution[v]
+            wff = substitution.get(v, (v,)) # some wvs dont make it into substitution
             proof, _ = parse_proof(self.rules["wff"], wff, self.variables, self.sentinels, steps)
             step.dependencies[f.label] = proof
 
@@ -453,7 +455,9 @@ class Spout:
                 step.rule = md.Rule(md.Statement("w"+mv, "$a", ("wff", mv), ()), (), (), (), ())
                 step.rule.finalize()
             step.substitution = {k: mp.substitute(v, substitution) for (k,v) in step.substitution.items()}
-            step.disjoint = set([(substitution[u][0], substitution[v][0]) for (u,v) in step.disjoint]) # todo: is this right?
+            # disjoint requirements are variable masks, rename the variables in each pair and rebuild them
+            pairs = [(x, y) for (u_mask, v_mask) in step.disjoint for x in mp.mask_variables(u_mask) for y in mp.mask_variables(v_mask)]
+            step.disjoint = mp.disjoint_masks((substitution.get(x, (x,))[0], substitution.get(y, (y,))[0]) for (x, y) in pairs) # todo: is this right?
             # print(proof.tree_string())
             # input('.')
 
@@ -0,0 +1,55 @@
+# run from mmpy with $ python -m src.mmmine.step_memory [path/to/file.mm]
+"""
+Memory benchmark for the proof step DAGs of all theorems in a database
+Compares the compact ProofSteps (slots, premises aligned with rule hypotheses, substitution derived on demand)
+with an equivalent copy in the original layout (per-instance __dict__, dependency and substitution dicts)
+Rules and their statements are shared with the database and not counted
+"""
+import sys
+from ..metamathpy import database as md
+from ..metamathpy import proof as mp
+from ..metamathpy import setmm as ms
+from .rule_memory import deep_size, DictObject
+
+def legacy_copy(roots):
+    """
+    copy of the proof DAGs under roots in the original step layout, preserving shared steps
+    """
+    copies = {} # id(step): copy
+    for root in roots:
+        stack = [(root, False)]
+        while len(stack) > 0:
+            step, ready = stack.pop()
+            if id(step) in copies: continue
+            if not ready:
+                # copy the dependencies first
+                stack.append((step, True))
+                stack.extend((dep, False) for dep in step.dependencies.values())
+                continue
+            copies[id(step)] = DictObject(
+                conclusion = step.conclusion,
+                rule = step.rule,
+                dependencies = {label: copies[id(dep)] for (label, dep) in step.dependencies.items()},
+                substitution = step.substitution,
+                disjoint = step.disjoint,
+                variables = step.variables,
+                _normal_proof = None,
+            )
+    return [copies[id(root)] for root in roots]
+
+if __name__ == "__main__":
+
+    if len(sys.argv) > 1:
+        db = md.parse(sys.argv[1])
+    else:
+        db = ms.load_all()
+
+    # the trees that verify_all checks, built for every theorem
+    roots = [mp.verify_proof(db, rule)[0] for rule in db.rules.values() if rule.consequent.tag == "$p"]
+
+    compact = deep_size(roots, skip=md.Rule)
+    legacy = deep_size(legacy_copy(roots), skip=md.Rule)
+
+    print(f"{len(roots)} proofs")
+    print(f"original layout: {legacy / 2**20:.1f} MiB")
+    print(f"compact layout:  {compact / 2**20:.1f} MiB ({100 * compact / legacy:.0f}%)")
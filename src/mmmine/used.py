@@ -9,6 +9,7 @@ from time import perf_counter
 from ..metamathpy import database as md
 from ..metamathpy import proof as mp
 from ..metamathpy import setmm as ms
+from ..metamathpy.stepstore import StepStore
 
 # proof length and size (uncompressed)
 def proof_metrics(root):
@@ -34,6 +35,7 @@ if __name__ == "__main__":
         proof_lengths = {}
         form_lengths = {}
         label_counts = {}
+        store = StepStore() # share subproofs between theorems
         for r, (label, rule) in enumerate(db.rules.items()):
             print(f"rule {r} ({label}) of {len(db.rules)}...")
 
@@ -48,7 +50,7 @@ if __name__ == "__main__":
             theorem_labels.add(label)
     
             # uncompress proof
-            root, steps = mp.verify_proof(db, rule)
+            root, steps = mp.verify_proof(db, rule, store)
 
             # track metrics
             # proof = root.normal_proof()
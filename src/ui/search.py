@@ -9,7 +9,7 @@ import metamathpy.database as md
 import metamathpy.proof as mp
 import metamathpy.piletrie as mt
 import metamathpy.backsearch as mb
-from metamathpy.substitution import Scheme, substitute, standardize, multibinder, pilebinder
+from metamathpy.substitution import Scheme, PileIndex, substitute, standardize, multibinder, pilebinder
 
 try:
     profile
@@ -63,6 +63,7 @@ def closure_step(rules, steps):
     returns new_steps, same format as steps
     """
     new_steps = {"wff": {}, "|-": {}}
+    pile = PileIndex(steps["|-"]) # shared by all rules
     for rule in rules["|-"]:
         # check if essentials contain all mandatories
         contained = len(rule.mandatory - set(sum([e.tokens for e in rule.essentials], []))) == 0
@@ -75,7 +76,7 @@ def closure_step(rules, steps):
             schemes, _ = standardize(schemes) # needed for multibinder to work correctly
 
             # try all essential matches
-            for bindings, essential_dependencies in multibinder(schemes[len(rule.floatings):], steps["|-"]):
+            for bindings, essential_dependencies in multibinder(schemes[len(rule.floatings):], pile):
 
                 # backsearch on floating hypotheses under binding
                 floating_dependencies = []
@@ -0,0 +1,52 @@
+$( Small fixture with disjoint variable restrictions, nested scopes and compressed proofs $)
+$c ( ) -> A. wff set |- $.
+$v ph ps x y $.
+wph $f wff ph $.
+wps $f wff ps $.
+vx $f set x $.
+vy $f set y $.
+wi $a wff ( ph -> ps ) $.
+wal $a wff A. x ph $.
+
+${
+  $d x ph $.
+  ax-5 $a |- ( ph -> A. x ph ) $.
+$}
+
+${
+  min $e |- ph $.
+  maj $e |- ( ph -> ps ) $.
+  ax-mp $a |- ps $.
+$}
+
+ax-1 $a |- ( ph -> ( ps -> ph ) ) $.
+
+${
+  $v z $.
+  vz $f set z $.
+  $d z ph $.
+  ax-5z $a |- ( ph -> A. z ph ) $.
+  ${
+    $d x z $.
+    alz $p |- ( ph -> A. z ph ) $=
+      ( ax-5z ) ABC $.
+  $}
+$}
+
+${
+  $d x y $.
+  $d x ps $.
+  $( substitute A. y ps for ph in ax-5 $)
+  alal $p |- ( A. y ps -> A. x A. y ps ) $=
+    ( wal ax-5 ) ACDBE $.
+$}
+
+$( reuses a tagged subproof $)
+idd $p |- ( ( ps -> ph ) -> ( ( ps -> ph ) -> ( ps -> ph ) ) ) $=
+  ( wi ax-1 ) BACZED $.
+
+${
+  a1i.1 $e |- ph $.
+  a1i $p |- ( ps -> ph ) $=
+    wph wps wph wi a1i.1 wph wps ax-1 ax-mp $.
+$}
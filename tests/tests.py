@@ -2,12 +2,25 @@
 Run from parent directory with
 $ python -m tests.tests
 """
+import importlib.util
 import os
+import shutil
+import tempfile
 import unittest as ut
-from src.metamathpy.substitution import substitute
-from src.metamathpy.proof import verify_all
+from unittest import mock
+from src.metamathpy.substitution import substitute, multibinder, pilebinder, PileIndex, Scheme, Template
+from src.metamathpy.piletrie import trieify
+from src.metamathpy.proof import check_proof, verify_all, verify_each, verify_proof
 # from src.parse import parse as parse, Database
 from src.metamathpy.database import parse as read
+from src.metamathpy import database as md
+from src.metamathpy import setmm as sm
+from src.metamathpy import index as mi
+from src.metamathpy import proof as mp
+from src.metamathpy import verifycache as vc
+from src.metamathpy import depgraph as dg
+from src.metamathpy import pipeline as pl
+from src.metamathpy import stepstore as ss
 
 class TestSubstitute(ut.TestCase):
 
@@ -32,6 +45,21 @@ class TestSubstitute(ut.TestCase):
         actual_result = substitute(symbols, substitution)
         self.assertEqual(expected_result, actual_result)
 
+    def test_template(self):
+        symbols = ("(", "a", "->", "(", "c", "->", "a", ")", ")")
+        substitution = {"a" : ('B', '->', 'C'), "c" : ('D',)}
+        template = Template(symbols, ("c", "a"))
+        self.assertEqual(template.instantiate([substitution["c"], substitution["a"]]), substitute(symbols, substitution))
+        self.assertEqual(Template(symbols, ()).instantiate([]), symbols)
+
+    def test_rule_templates(self):
+        db = read(os.path.join('tests', 'p2.mm'))
+        for rule in db.rules.values():
+            substitution = {f.tokens[1]: ("(", f.label, ")") for f in rule.floatings}
+            bindings = [substitution[f.tokens[1]] for f in rule.floatings]
+            for statement, template in zip(rule.essentials + (rule.consequent,), rule.templates):
+                self.assertEqual(template.instantiate(bindings), substitute(statement.tokens, substitution))
+
 # class TestParse(ut.TestCase):
 
 #     def test_good_parse(self):
@@ -70,6 +98,82 @@ class TestVerify(ut.TestCase):
         db = read(fpath)
         verify_all(db)           
 
+class TestVerifyEach(ut.TestCase):
+    def test_same_as_serial(self):
+        for fname in ('p2.mm', 'dv.mm'):
+            db = read(os.path.join('tests', fname))
+            serial = list(verify_each(db))
+            self.assertEqual(serial, list(verify_each(db, processes=2, chunksize=1)))
+            self.assertEqual([label for (label, _, _) in serial], [l for (l, r) in db.rules.items() if r.consequent.tag == "$p"])
+            self.assertTrue(all(ok for (_, ok, _) in serial))
+
+    def test_failures_reported(self):
+        db = read(os.path.join('tests', 'p2.mm'))
+        stmt = db.rules["mpd"].consequent
+        db.rules["mpd"].consequent = md.Statement(stmt.label, stmt.tag, stmt.tokens, stmt.proof[:-1])
+        results = {label: (ok, msg) for (label, ok, msg) in verify_each(db, processes=2)}
+        self.assertFalse(results["mpd"][0])
+        self.assertIn("stack of size", results["mpd"][1])
+        self.assertTrue(results["syl"][0])
+
+class TestCheckProof(ut.TestCase):
+    def test_valid(self):
+        for fname in ('p2.mm', 'dv.mm'):
+            db = read(os.path.join('tests', fname))
+            for rule in db.rules.values():
+                if rule.consequent.tag == "$p": self.assertEqual(check_proof(db, rule), "")
+
+    def test_invalid_proof(self):
+        db = read(os.path.join('tests', 'dv.mm'))
+        for label in ("alal", "a1i"):
+            stmt = db.rules[label].consequent
+            db.rules[label].consequent = md.Statement(stmt.label, stmt.tag, stmt.tokens, stmt.proof[:-1])
+            self.assertNotEqual(check_proof(db, db.rules[label]), "")
+
+    def test_missing_disjoint(self):
+        db = read(os.path.join('tests', 'dv.mm'))
+        claim = db.rules["alz"]
+        claim.disjoint = frozenset(pair for pair in claim.disjoint if "ph" not in pair)
+        self.assertIn("missing $d", check_proof(db, claim))
+        with self.assertRaisesRegex(AssertionError, "missing \\$d"): verify_proof(db, claim)
+
+    def test_plain_set_disjoint(self):
+        # hand-built rules keep their $d pairs and variables in plain (unhashable) sets
+        db = read(os.path.join('tests', 'dv.mm'))
+        r = db.rules["alal"]
+        claim = md.Rule(r.consequent, r.essentials, r.floatings, set(r.disjoint), set(r.variables))
+        claim.finalize()
+        self.assertEqual(check_proof(db, claim), "")
+        self.assertEqual(mp.verify_claim(db, claim), ("alal", True, ""))
+        verify_proof(db, claim)
+
+    def test_violated_disjoint(self):
+        db = read(os.path.join('tests', 'dv.mm'))
+        claim = db.rules["alal"]
+        # substitute A. x ph for ph in ax-5, which shares x with the other side of $d x ph
+        tokens = tuple("|- ( A. x ph -> A. x A. x ph )".split())
+        claim.consequent = md.Statement("alal", "$p", tokens, "wph vx wal vx ax-5".split())
+        self.assertIn("violated", check_proof(db, claim))
+        with self.assertRaisesRegex(AssertionError, "violated"): verify_proof(db, claim)
+
+class TestDisjointMasks(ut.TestCase):
+    def test_masks(self):
+        mask = mp.variable_mask(("ph", "x", "ps"))
+        self.assertEqual(sorted(mp.mask_variables(mask)), ["ph", "ps", "x"])
+        self.assertEqual(mp.variable_mask(("x",)) & mask, mp.variable_mask(("x",)))
+
+    def test_missing(self):
+        partners = mp.disjoint_partners(frozenset({("ph", "x"), ("x", "y")}))
+        inherited = ((mp.variable_mask(("x",)), mp.variable_mask(("ph", "y", "ps"))),)
+        self.assertEqual(mp.missing_disjoint(inherited, partners), {("ps", "x")})
+
+    def test_slots(self):
+        db = read(os.path.join('tests', 'dv.mm'))
+        rule = db.rules["ax-5"]
+        self.assertEqual([f.tokens[1] for f in rule.floatings], ["ph", "x"])
+        self.assertEqual(rule.disjoint_slots, ((0, 1),))
+        self.assertEqual(db.rules["ax-1"].disjoint_slots, ())
+
 class TestDatabase(ut.TestCase):
     def test_good_parse(self):
         fpath = os.path.join('tests', 'p2.mm')
@@ -85,5 +189,643 @@ class TestDatabase(ut.TestCase):
         db = read(fpath)
         self.assertEqual(len(db.rules), 18)
 
+class TestSnapshot(ut.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.fpath = os.path.join(self.cache_dir, 'p2.mm')
+        shutil.copy(os.path.join('tests', 'p2.mm'), self.fpath)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_warm_load(self):
+        cold = read(self.fpath, cache_dir=self.cache_dir)
+        path = md.snapshot_path(self.fpath, self.cache_dir)
+        self.assertTrue(os.path.exists(path))
+        warm = read(self.fpath, cache_dir=self.cache_dir)
+        self.assertEqual(list(cold.rules), list(warm.rules))
+        self.assertEqual(str(cold.rules['syl']), str(warm.rules['syl']))
+        verify_all(warm)
+
+    def test_keyed_by_arguments(self):
+        db = read(self.fpath, last_rule="a1i", cache_dir=self.cache_dir)
+        self.assertEqual(list(db.rules)[-1], "a1i")
+        self.assertEqual(len(read(self.fpath, cache_dir=self.cache_dir).rules), 21)
+
+    def test_invalidated_by_edit(self):
+        read(self.fpath, cache_dir=self.cache_dir)
+        with open(self.fpath, "a") as f: f.write("extra $a wff P $.\n")
+        db = read(self.fpath, cache_dir=self.cache_dir)
+        self.assertIn("extra", db.rules)
+
+    def test_setmm_cache_next_to_file(self):
+        db = sm.load_full(self.fpath)
+        self.assertIs(sm.load_to("a1i", self.fpath).rules["a1i"], db.rules["a1i"])
+        cache_dir = os.path.join(self.cache_dir, ".mmpy_cache")
+        self.assertTrue(os.path.exists(md.snapshot_path(self.fpath, cache_dir)))
+        sm._full_databases.pop(self.fpath)
+
+class TestPrefixView(ut.TestCase):
+    def setUp(self):
+        self.db = read(os.path.join('tests', 'p2.mm'))
+
+    def test_matches_truncated_parse(self):
+        view = self.db.prefix("a2i")
+        truncated = read(os.path.join('tests', 'p2.mm'), last_rule="a2i")
+        self.assertEqual(list(view.rules), list(truncated.rules))
+        self.assertEqual(list(view.statements), list(truncated.statements))
+        self.assertIs(view.rules["a1i"], self.db.rules["a1i"])
+        self.assertNotIn("mpd", view.rules)
+        with self.assertRaises(KeyError): view.rules["mpd"]
+
+    def test_exclude(self):
+        view = self.db.prefix("a2i", exclude=("wn",))
+        self.assertNotIn("wn", view.rules)
+        self.assertIs(view.statements["wn"], self.db.statements["wn"])
+        self.assertEqual(len(view.rules), len(list(view.rules)))
+        view.rules.pop("ax3")
+        self.assertNotIn("ax3", view.rules)
+        self.assertIn("ax3", self.db.rules)
+        self.assertEqual(len(view.rules), len(list(view.rules)))
+        rules = view.rules_up_to("a2i")
+        self.assertEqual(rules["all"][-1].consequent.label, "a1i")
+
+class TestParallelParse(ut.TestCase):
+    def test_same_as_serial(self):
+        fpath = os.path.join('tests', 'p2.mm')
+        serial, parallel = read(fpath), read(fpath, processes=2)
+        self.assertEqual(list(serial.statements.items()), list(parallel.statements.items()))
+        self.assertEqual(list(serial.rules), list(parallel.rules))
+        for label, rule in serial.rules.items():
+            self.assertEqual(str(rule), str(parallel.rules[label]))
+        verify_all(parallel)
+
+    def test_labels_on_own_lines(self):
+        # a segment must not start between a label and its keyword
+        fpath = os.path.join('tests', 'p2labels.mm')
+        serial, parallel = read(fpath), read(fpath, processes=4)
+        self.assertEqual(list(serial.statements.items()), list(parallel.statements.items()))
+        for label, rule in serial.rules.items():
+            self.assertEqual(str(rule), str(parallel.rules[label]))
+        lines = list(md.read_lines(fpath))
+        for start, stop, frame in md.scan_segments(lines, len(lines)):
+            self.assertNotIn(lines[start][:1], (["$f"], ["$e"], ["$a"], ["$p"]))
+
+    def test_segments(self):
+        lines = list(md.read_lines(os.path.join('tests', 'p2.mm')))
+        segments = md.scan_segments(lines, 4)
+        self.assertGreater(len(segments), 1)
+        start, stop, frame = segments[-1]
+        self.assertEqual(frame["v"], ["P", "Q", "R"])
+        self.assertEqual([f.label for f in frame["f"]], ["wp", "wq", "wr"])
+
+    def test_bad_parse(self):
+        fpath = os.path.join('tests', 'badparse.mm')
+        with self.assertRaisesRegex(AssertionError, "Last comment never terminated"): read(fpath, processes=2)
+
+class TestMmapTokenizer(ut.TestCase):
+    def test_same_database(self):
+        for fname in ('p2.mm', 'test.mm'):
+            fpath = os.path.join('tests', fname)
+            lines, mapped = read(fpath), read(fpath, tokenizer=md.mmap_lines)
+            self.assertEqual(list(lines.statements.items()), list(mapped.statements.items()))
+            for label, rule in lines.rules.items():
+                self.assertEqual(str(rule), str(mapped.rules[label]))
+
+    def test_same_line_numbers(self):
+        fpath = os.path.join('tests', 'p2.mm')
+        self.assertEqual(len(list(md.read_lines(fpath))), len(list(md.mmap_lines(fpath))))
+        truncated = read(fpath, last_rule="a2i", tokenizer=md.mmap_lines)
+        self.assertEqual(list(truncated.rules), list(read(fpath, last_rule="a2i").rules))
+
+    def test_comments_removed(self):
+        tokens = [token for line in md.mmap_lines(os.path.join('tests', 'p2.mm')) for token in line]
+        self.assertNotIn("$(", tokens)
+        self.assertNotIn("Margaris", tokens)
+
+    def test_bad_parse(self):
+        fpath = os.path.join('tests', 'badparse.mm')
+        with self.assertRaisesRegex(AssertionError, "Last comment never terminated"): read(fpath, tokenizer=md.mmap_lines)
+
+class TestInterned(ut.TestCase):
+    def setUp(self):
+        fpath = os.path.join('tests', 'p2.mm')
+        self.db, self.interned = read(fpath), read(fpath, interned=True)
+
+    def test_symbol_table(self):
+        symbols = self.interned.symbols
+        self.assertEqual(sorted(symbols.ids.values()), list(range(len(symbols))))
+        for label, rule in self.db.rules.items():
+            interned = self.interned.rules[label]
+            self.assertTrue(all(type(token) is int for token in interned.consequent.tokens))
+            self.assertEqual(symbols.decode(interned.consequent.tokens), rule.consequent.tokens)
+            self.assertEqual(set(symbols.decode(interned.variables)), rule.variables)
+            self.assertEqual([h.label for h in interned.hypotheses], [h.label for h in rule.hypotheses])
+        self.assertEqual(symbols.decode(self.interned.statements['syl'].tokens), self.db.statements['syl'].tokens)
+
+    def test_verify(self):
+        verify_all(self.interned)
+        root, _ = verify_proof(self.interned, self.interned.rules['syl'])
+        self.assertEqual(self.interned.symbols.decode(root.conclusion), tuple(self.db.rules['syl'].consequent.tokens))
+
+    def test_prefix(self):
+        view = self.interned.prefix("a2i")
+        self.assertIs(view.symbols, self.interned.symbols)
+        self.assertEqual(view.symbols.decode(view.statements['a1i'].tokens), self.db.statements['a1i'].tokens)
+
+class TestLazyRule(ut.TestCase):
+    def test_built_on_access(self):
+        db = read(os.path.join('tests', 'p2.mm'))
+        verify_all(db)
+        rule = db.rules['syl']
+        self.assertIsNone(rule._scheme)
+        self.assertIsNone(rule._mandatory)
+        self.assertEqual(rule.mandatory, {'P': 'wff', 'Q': 'wff', 'R': 'wff'})
+        scheme = rule.scheme
+        self.assertIs(scheme, rule.scheme)
+        self.assertEqual(scheme.tokens, rule.consequent.tokens)
+        self.assertEqual(set(scheme.variables), rule.variables)
+
+class TestScope(ut.TestCase):
+    def setUp(self):
+        self.db = read(os.path.join('tests', 'dv.mm'))
+
+    def test_nested_scopes(self):
+        rules = self.db.rules
+        self.assertEqual(set(rules['alz'].disjoint), {('ph', 'z'), ('x', 'z')})
+        self.assertIn('z', rules['alz'].variables)
+        self.assertNotIn('z', rules['alal'].variables)
+        self.assertEqual(set(rules['alal'].disjoint), {('x', 'y'), ('ps', 'x')})
+        self.assertEqual(set(rules['idd'].disjoint), set())
+        self.assertEqual([h.label for h in rules['alal'].hypotheses], ['wps', 'vx', 'vy'])
+        self.assertEqual([h.label for h in rules['a1i'].hypotheses], ['wph', 'wps', 'a1i.1'])
+
+    def test_shared_sets(self):
+        rules = self.db.rules
+        self.assertIs(rules['wi'].variables, rules['wal'].variables)
+        self.assertIs(rules['wi'].disjoint, rules['wal'].disjoint)
+        verify_all(self.db)
+
+class TestIndex(ut.TestCase):
+    def test_lazy_rules(self):
+        for fname in ('p2.mm', 'dv.mm'):
+            fpath = os.path.join('tests', fname)
+            db = read(fpath)
+            with mi.LazyDatabase(fpath) as lazy:
+                self.assertEqual(list(lazy.rules), list(db.rules))
+                self.assertEqual(len(lazy.rules.cache), 0)
+                self.assertEqual(str(lazy.rules['a1i']), str(db.rules['a1i']))
+                self.assertEqual(len(lazy.rules.cache), 1)
+                for label, rule in db.rules.items():
+                    self.assertEqual(str(lazy.rules[label]), str(rule))
+                    self.assertEqual(lazy.statements[label], db.statements[label])
+                verify_all(lazy)
+
+    def test_persisted(self):
+        cache_dir = tempfile.mkdtemp()
+        try:
+            fpath = os.path.join(cache_dir, 'dv.mm')
+            shutil.copy(os.path.join('tests', 'dv.mm'), fpath)
+            index = mi.load_index(fpath, cache_dir)
+            self.assertTrue(os.path.exists(mi.index_path(fpath, cache_dir)))
+            self.assertEqual(mi.load_index(fpath, cache_dir).labels, index.labels)
+            with open(fpath, "a") as f: f.write("extra $a wff ph $.\n")
+            self.assertIn("extra", mi.load_index(fpath, cache_dir).labels)
+        finally:
+            shutil.rmtree(cache_dir)
+
+class TestIncremental(ut.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.fpath = os.path.join(self.cache_dir, 'dv.mm')
+        with open(os.path.join('tests', 'dv.mm')) as f: self.source = f.read()
+        with open(self.fpath, "w") as f: f.write(self.source)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def assertSameAsFullParse(self, db):
+        full = read(self.fpath)
+        self.assertEqual(list(db.rules), list(full.rules))
+        self.assertEqual(list(db.statements.items()), list(full.statements.items()))
+        for label, rule in full.rules.items():
+            # str(rule) does not show the proof or the variables, so those are compared separately
+            other = db.rules[label]
+            self.assertEqual(str(other), str(rule))
+            self.assertEqual((other.consequent, other.variables), (rule.consequent, rule.variables))
+
+    def test_edits(self):
+        db, changes = mi.parse_incremental(self.fpath, self.cache_dir)
+        self.assertEqual(len(changes["added"]), len(db.rules))
+
+        # change a proof, add a theorem, remove a theorem, change a scope
+        source = self.source.replace("  ( wi ax-1 ) BACZED $.", "  wps wph wi wps wph wi ax-1 $.")
+        source = source.replace("ax-1 $a |- ( ph -> ( ps -> ph ) ) $.", "ax-1 $a |- ( ph -> ( ps -> ph ) ) $.\nid1 $a |- ( ph -> ph ) $.")
+        source = source.replace("    ( ax-5z ) ABC $.\n", "    ( ax-5z ) ABC $.\n    alz2 $a |- ( ph -> A. z ph ) $.\n")
+        source = source.replace("  $d x ps $.\n", "  $d x ps $.\n  $d ps y $.\n")
+        source = source[:source.index("${\n  a1i.1 $e")]
+        with open(self.fpath, "w") as f: f.write(source)
+
+        db, changes = mi.parse_incremental(self.fpath, self.cache_dir)
+        self.assertEqual(changes["added"], ["id1", "alz2"])
+        self.assertEqual(changes["removed"], ["a1i.1", "a1i"])
+        self.assertEqual(changes["modified"], ["alal", "idd"])
+        self.assertSameAsFullParse(db)
+        verify_all(db)
+
+        # remove a theorem again, unchanged rules are kept in place
+        index = mi.build_index(self.fpath, digests=True)
+        with open(self.fpath, "w") as f: f.write(source.replace("id1 $a |- ( ph -> ph ) $.", ""))
+        alal = db.rules["alal"]
+        index, changes = mi.reparse(db, index, self.fpath)
+        self.assertEqual(changes, {"added": [], "removed": ["id1"], "modified": []})
+        self.assertIs(db.rules["alal"], alal)
+        self.assertSameAsFullParse(db)
+
+class TestVerificationCache(ut.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.fpath = os.path.join(self.cache_dir, 'dv.mm')
+        with open(os.path.join('tests', 'dv.mm')) as f: self.source = f.read()
+        with open(self.fpath, "w") as f: f.write(self.source)
+        self.path = vc.cache_path(self.fpath, self.cache_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_skip_unchanged(self):
+        db = read(self.fpath)
+        verify_all(db, cache=vc.VerificationCache(self.path))
+        cache = vc.VerificationCache(self.path)
+        self.assertEqual(sorted(cache.entries), ["a1i", "alal", "alz", "idd"])
+
+        # editing an axiom invalidates exactly the theorems whose proofs use it
+        with open(self.fpath, "w") as f: f.write(self.source.replace("ax-1 $a |- ( ph -> ( ps -> ph ) ) $.", "ax-1 $a |- ( ph -> ( ps -> ( ph ) ) ) $."))
+        db = read(self.fpath)
+        fresh = [label for label, rule in db.rules.items() if rule.consequent.tag == "$p" and not cache.is_verified(db, rule)]
+        self.assertEqual(fresh, ["idd", "a1i"])
+
+        # failed claims are dropped from the cache
+        results = {label: ok for (label, ok, _) in verify_each(db, cache=cache)}
+        self.assertEqual(results, {"alz": True, "alal": True, "idd": False, "a1i": False})
+        self.assertEqual(sorted(cache.entries), ["alal", "alz"])
+
+    def test_disjoint_in_key(self):
+        db = read(self.fpath)
+        cache = vc.VerificationCache()
+        verify_all(db, cache=cache)
+        claim = db.rules["alz"]
+        claim.disjoint = frozenset(pair for pair in claim.disjoint if "ph" not in pair)
+        self.assertFalse(cache.is_verified(db, claim))
+        with self.assertRaisesRegex(AssertionError, "missing \\$d"): verify_all(db, cache=cache)
+
+class TestDependencyGraph(ut.TestCase):
+    def test_uses(self):
+        db = read(os.path.join('tests', 'dv.mm'))
+        graph = dg.DependencyGraph(db)
+        self.assertEqual(graph.uses["a1i"], ["wi", "ax-1", "ax-mp"])
+        self.assertEqual(graph.uses["alal"], ["wal", "ax-5"])
+        self.assertEqual(sorted(graph.users["wi"]), ["a1i", "idd"])
+
+    def test_affected(self):
+        db = read(os.path.join('tests', 'p2.mm'))
+        graph = dg.DependencyGraph(db)
+        self.assertEqual(graph.affected(["a2i"]), ["a2i", "mpd", "syl"])
+        self.assertEqual(graph.affected(["a2i"], transitive=False), ["a2i", "mpd"])
+        self.assertEqual(graph.affected(["ax3"]), [])
+        self.assertEqual(graph.affected(["axm"], transitive=False), ["a1i", "a2i", "mpd"])
+        self.assertEqual(graph.affected(["axm"]), ["a1i", "a2i", "mpd", "syl"])
+
+    def test_verify_affected(self):
+        db = read(os.path.join('tests', 'p2.mm'))
+        results = list(dg.verify_affected(db, ["a1i"], processes=2))
+        self.assertEqual(results, [("a1i", True, ""), ("syl", True, "")])
+
+class TestPipeline(ut.TestCase):
+    def test_same_as_verify_each(self):
+        for fname in ('p2.mm', 'dv.mm'):
+            fpath = os.path.join('tests', fname)
+            expected = list(verify_each(read(fpath)))
+            for processes in (1, 2):
+                db = md.Database()
+                results = list(pl.parse_and_verify(fpath, db, processes=processes, batch_size=3))
+                if processes == 1: self.assertEqual(results, expected)
+                else: self.assertEqual(sorted(results), sorted(expected))
+                self.assertEqual(list(db.statements.items()), list(read(fpath).statements.items()))
+
+    def test_failures_reported(self):
+        cache_dir = tempfile.mkdtemp()
+        try:
+            fpath = os.path.join(cache_dir, 'p2.mm')
+            with open(os.path.join('tests', 'p2.mm')) as f: source = f.read()
+            with open(fpath, "w") as f: f.write(source.replace("mpd.maj a2i mpd.min axm $.", "mpd.maj a2i mpd.min $."))
+            results = {label: ok for (label, ok, _) in pl.parse_and_verify(fpath, processes=2)}
+            self.assertEqual(results, {"a1i": True, "a2i": True, "mpd": False, "syl": True})
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def test_bad_parse(self):
+        fpath = os.path.join('tests', 'badparse.mm')
+        with self.assertRaisesRegex(AssertionError, "Last comment never terminated"): list(pl.parse_and_verify(fpath, processes=2))
+
+    def test_verifier_error(self):
+        fpath = os.path.join('tests', 'p2.mm')
+        def broken(database, claim): raise ValueError("broken verifier")
+        with mock.patch.object(pl, 'verify_claim', broken):
+            with self.assertRaisesRegex(RuntimeError, "broken verifier"): list(pl.parse_and_verify(fpath, processes=2))
+
+    def test_verifier_dies(self):
+        # a verifier that exits without its end marker, like one killed by a signal, raises instead of hanging
+        fpath = os.path.join('tests', 'p2.mm')
+        def dying(connection, worker, num_workers, results):
+            while len(connection.recv_bytes()) > 0: pass
+            os._exit(3)
+        with mock.patch.object(pl, '_verify_worker', dying):
+            with self.assertRaisesRegex(RuntimeError, "exited with code 3"):
+                list(pl.parse_and_verify(fpath, processes=2, poll_interval=0.1))
+
+class TestDecodePointers(ut.TestCase):
+    def test_pointers(self):
+        self.assertEqual(mp.decode_pointers("ACDBE"), [0, 2, 3, 1, 4])
+        self.assertEqual(mp.decode_pointers("TUAYTUUAZ"), [19, 20, 119, 120, -1])
+        self.assertEqual(mp.decode_pointers(""), [])
+
+    def test_invalid(self):
+        for proof_string in ("AbC", "AU", "A C"):
+            with self.assertRaises(ValueError): mp.decode_pointers(proof_string)
+
+    def test_compressed(self):
+        db = read(os.path.join('tests', 'dv.mm'))
+        self.assertEqual(mp.decode_compressed(db.rules["idd"].consequent.proof), (["wi", "ax-1"], [1, 0, 2, -1, 4, 3]))
+
+class TestNormalToCompressed(ut.TestCase):
+    def test_round_trip(self):
+        for fname in ('p2.mm', 'dv.mm'):
+            db = read(os.path.join('tests', fname))
+            for rule in db.rules.values():
+                if rule.consequent.tag != "$p": continue
+                root, _ = verify_proof(db, rule)
+                stmt = rule.consequent
+                rule.consequent = md.Statement(stmt.label, stmt.tag, stmt.tokens, mp.normal_to_compressed(rule, root))
+                self.assertEqual(check_proof(db, rule), "")
+                self.assertEqual(verify_proof(db, rule)[0].conclusion, root.conclusion)
+
+    def test_matches_existing(self):
+        # dv.mm proofs were compressed by metamath.exe, re-encoding the normal proofs should reproduce them
+        db = read(os.path.join('tests', 'dv.mm'))
+        for label in ("alz", "alal", "idd"):
+            claim = db.rules[label]
+            root, _ = verify_proof(db, claim)
+            self.assertEqual(mp.normal_to_compressed(claim, root), list(claim.consequent.proof))
+
+    def test_repeated_ancestor_conclusion(self):
+        # the inner ax-mp step concludes the same "|- ph" as the root, and must still be expanded in full
+        text = """$c ( ) -> wff |- $. $v ph ps $. wph $f wff ph $. wps $f wff ps $.
+            wi $a wff ( ph -> ps ) $.
+            ${ min $e |- ph $. maj $e |- ( ph -> ps ) $. ax-mp $a |- ps $. $}
+            ${ h1 $e |- ph $. h2 $e |- ( ph -> ph ) $.
+               th $p |- ph $= wph wph wph wph h1 h2 ax-mp h2 ax-mp $. $}"""
+        db = md.Database()
+        for _ in md.parse_lines(db, [line.split() for line in text.split("\n")]): pass
+        claim = db.rules['th']
+        self.assertEqual(check_proof(db, claim), "")
+        root, _ = verify_proof(db, claim)
+        compressed = mp.normal_to_compressed(claim, root)
+        labels, pointers = mp.decode_compressed(compressed)
+        self.assertEqual(labels, ['ax-mp'])
+        self.assertEqual(pointers.count(len(claim.hypotheses)), 2) # both ax-mp steps are applied
+        stmt = claim.consequent
+        claim.consequent = md.Statement(stmt.label, stmt.tag, stmt.tokens, compressed)
+        self.assertEqual(check_proof(db, claim), "")
+
+    def test_encode_pointer(self):
+        pointers = [0, 19, 20, 119, 120, 619, 620, 12345]
+        self.assertEqual(mp.decode_pointers("".join(map(mp.encode_pointer, pointers))), pointers)
+
+class TestDeepProof(ut.TestCase):
+    def test_deep_chain(self):
+        # a chain much deeper than the recursion limit
+        db = read(os.path.join('tests', 'p2.mm'))
+        wp, wn = db.rules["wp"], db.rules["wn"]
+        step = mp.ProofStep(("wff", "P"), wp)
+        for n in range(5000): step = mp.ProofStep(("wff", n), wn, {"wp": step})
+        self.assertEqual(step.normal_proof(), ("wp",) + ("wn",) * 5000)
+        self.assertEqual(len(step.all_steps()), 5001)
+
+    def test_missing_premises(self):
+        db = read(os.path.join('tests', 'p2.mm'))
+        root, _ = verify_proof(db, db.rules['a1i'])
+        with self.assertRaisesRegex(ValueError, "axm"): mp.ProofStep(root.conclusion, root.rule).normal_proof()
+        partial = mp.ProofStep(root.conclusion, root.rule, {'min': root.dependencies['min']})
+        with self.assertRaisesRegex(ValueError, "axm"): mp.ProofStep(("wff", "X"), db.rules['wn'], [partial]).normal_proof()
+
+    def test_shared_steps(self):
+        db = read(os.path.join('tests', 'p2.mm'))
+        for rule in db.rules.values():
+            if rule.consequent.tag != "$p": continue
+            root, _ = verify_proof(db, rule)
+            self.assertEqual(root.normal_proof(), tuple(rule.consequent.proof))
+            self.assertEqual(len(root.all_steps()), len({step.conclusion for step in root.all_steps()}))
+
+class TestStepStore(ut.TestCase):
+    def test_shared_steps(self):
+        db = read(os.path.join('tests', 'p2.mm'))
+        store = ss.StepStore()
+        claims = [rule for rule in db.rules.values() if rule.consequent.tag == "$p"]
+        roots = [verify_proof(db, claim, store)[0] for claim in claims]
+        again = [verify_proof(db, claim, store)[0] for claim in claims]
+        for claim, root, other in zip(claims, roots, again):
+            self.assertIs(root, other)
+            self.assertEqual(root.normal_proof(), tuple(claim.consequent.proof))
+        self.assertGreater(store.hits, 0)
+        self.assertEqual(len(store), len(set(store.steps.values())))
+
+    def test_eviction(self):
+        db = read(os.path.join('tests', 'dv.mm'))
+        store = ss.StepStore(max_steps=3)
+        for rule in db.rules.values():
+            if rule.consequent.tag != "$p": continue
+            root, _ = verify_proof(db, rule, store)
+            self.assertEqual(root.conclusion, tuple(rule.consequent.tokens))
+            self.assertLessEqual(len(store), 3)
+        self.assertEqual(sum(count for (_, count) in store.conclusions.values()), len(store))
+
+    def test_missing_disjoint(self):
+        # shared steps are still checked against the $d requirements of each claim
+        db = read(os.path.join('tests', 'dv.mm'))
+        store = ss.StepStore()
+        verify_proof(db, db.rules["alz"], store)
+        db.rules["alz"].disjoint = frozenset(pair for pair in db.rules["alz"].disjoint if "ph" not in pair)
+        with self.assertRaisesRegex(AssertionError, "missing \\$d"): verify_proof(db, db.rules["alz"], store)
+
+class TestCompactStep(ut.TestCase):
+    def test_dependencies(self):
+        db = read(os.path.join('tests', 'p2.mm'))
+        root, _ = verify_proof(db, db.rules['a1i'])
+        labels = [hyp.label for hyp in root.rule.hypotheses]
+        self.assertEqual(list(root.dependencies), labels)
+        self.assertEqual(len(root.dependencies), len(root.premises))
+        self.assertEqual(dict(root.dependencies), dict(zip(labels, root.premises)))
+        self.assertIs(root.dependencies['maj'], root.premises[labels.index('maj')])
+        with self.assertRaises(KeyError): root.dependencies['a1i.1']
+
+        # a dict by label and a sequence aligned with the hypotheses give the same premises
+        by_label = mp.ProofStep(root.conclusion, root.rule, dict(root.dependencies))
+        self.assertEqual(by_label.premises, root.premises)
+        with self.assertRaises(KeyError): mp.ProofStep(root.conclusion, root.rule, {'nope': root})
+
+    def test_substitution(self):
+        db = read(os.path.join('tests', 'p2.mm'))
+        root, _ = verify_proof(db, db.rules['a1i'])
+        self.assertEqual(root.substitution, {'P': ('P',), 'Q': ('(', 'Q', '>', 'P', ')')})
+        self.assertEqual(mp.ProofStep(root.conclusion, root.rule).substitution, {})
+        given = mp.ProofStep(root.conclusion, root.rule, root.premises, {'P': ('Q',)})
+        self.assertEqual(given.substitution, {'P': ('Q',)})
+        self.assertFalse(hasattr(root, '__dict__'))
+
+    def test_assign_dependency(self):
+        db = read(os.path.join('tests', 'p2.mm'))
+        root, _ = verify_proof(db, db.rules['a1i'])
+        step = mp.ProofStep(root.conclusion, root.rule, {'min': root.dependencies['min']}, {'P': ('P',)})
+        step.dependencies['maj'] = root.dependencies['maj']
+        self.assertEqual(list(step.dependencies), ['maj', 'min'])
+        self.assertEqual(step.substitution, {})
+        with self.assertRaises(KeyError): step.dependencies['nope'] = root
+
+    @ut.skipIf(importlib.util.find_spec('numpy') is None, 'spouts requires numpy')
+    def test_complete_floating(self):
+        from src.mmmine.spouts import Spout
+        db = read(os.path.join('tests', 'p2.mm'))
+        root, _ = verify_proof(db, db.rules['a1i'])
+
+        # drop the floating premises of every step, keeping the essentials and explicit substitutions
+        def strip(step):
+            essentials = {e.label: strip(step.dependencies[e.label]) for e in step.rule.essentials if e.label in step.dependencies}
+            return mp.ProofStep(step.conclusion, step.rule, essentials, dict(step.substitution))
+        stripped = strip(root)
+
+        spout = Spout.__new__(Spout)
+        spout.rules = {'wff': [db.rules['wi'], db.rules['wn']]}
+        spout.variables, spout.sentinels = {'P', 'Q', 'R'}, set()
+        spout.complete_floating(stripped)
+        # variables are proved by placeholder rules named after them (see parsing.parse_proof)
+        self.assertEqual(stripped.normal_proof(), tuple("wP wQ wP wi wP wQ ax1 a1i.1 axm".split()))
+
+    @ut.skipIf(importlib.util.find_spec('numpy') is None, 'spouts requires numpy')
+    def test_revert_disjoint(self):
+        from src.mmmine.spouts import Spout
+        db = read(os.path.join('tests', 'dv.mm'))
+        claim = db.rules['alal']
+        root, _ = verify_proof(db, claim)
+
+        # pretend y is a work variable, which reverts to the only metavariable z of the claim
+        spout = Spout.__new__(Spout)
+        spout.claim, spout.variables, spout.sentinels = claim, {'y'}, set()
+        spout.revert_metavariables(md.Rule(claim.consequent, claim.essentials, claim.floatings, set(), {'z'}), root)
+        self.assertEqual(root.conclusion, tuple("|- ( A. z ps -> A. x A. z ps )".split()))
+        pairs = {(x, y) for (u, v) in root.disjoint for x in mp.mask_variables(u) for y in mp.mask_variables(v)}
+        self.assertEqual({tuple(sorted(pair)) for pair in pairs}, {('ps', 'x'), ('x', 'z')})
+
+class TestSchemeMatches(ut.TestCase):
+    def test_matches(self):
+        scheme = Scheme("( P -> ( Q -> P ) )".split(), ("P", "Q"))
+        tokens = tuple("( ( a -> b ) -> ( c -> ( a -> b ) ) )".split())
+        self.assertEqual(list(scheme.matches(tokens)), [{"P": ("(", "a", "->", "b", ")"), "Q": ("c",)}])
+        self.assertEqual(list(scheme.matches(tokens[:-1])), [])
+        self.assertEqual(list(Scheme(("a",), ()).matches(("a",))), [{}])
+
+    def test_all_splits(self):
+        # every match is found, in order of increasing binding lengths from the left
+        scheme = Scheme("P x Q x R".split(), ("P", "Q", "R"))
+        tokens = tuple("a x b x c x d".split())
+        matches = list(scheme.matches(tokens))
+        self.assertEqual([(len(m["P"]), len(m["Q"])) for m in matches], [(1, 1), (1, 3), (3, 1)])
+        for m in matches: self.assertEqual(scheme.substitute(m), tokens)
+
+    def test_balanced(self):
+        scheme = Scheme("( P -> Q )".split(), ("P", "Q"))
+        tokens = tuple("( ( a -> b ) -> c )".split())
+        self.assertEqual(len(list(scheme.matches(tokens))), 2)
+        self.assertEqual(list(scheme.matches(tokens, balanced=True)), [{"P": ("(", "a", "->", "b", ")"), "Q": ("c",)}])
+
+class TestMultibinder(ut.TestCase):
+    def setUp(self):
+        statements = ["|- ps", "|- ( ps -> ch )", "|- ( ch -> ph )", "|- ( ps -> ps )", "wff ps", "|- -. ph"]
+        self.pile = {tuple(statement.split()): statement for statement in statements}
+
+    def test_index(self):
+        index = PileIndex(self.pile)
+        self.assertEqual(dict(index), self.pile)
+        self.assertIn(tuple("|- ps".split()), index)
+        self.assertEqual(len(index.candidates(Scheme("|- ( v0 -> v1 )".split(), ("v0", "v1")))), 3)
+        self.assertEqual(len(index.candidates(Scheme("|- v0".split(), ("v0",)))), 5)
+        self.assertEqual(len(index.candidates(Scheme("v0 ps".split(), ("v0",)))), 6)
+        self.assertEqual(index.candidates(Scheme("|- ps".split(), ())), ((tuple("|- ps".split()), "|- ps"),))
+        index.add(tuple("|- ( ph -> ps )".split()), "|- ( ph -> ps )")
+        self.assertEqual(len(index.candidates(Scheme("|- ( v0 -> v1 )".split(), ("v0", "v1")))), 4)
+
+    def test_binds(self):
+        # steps are yielded in scheme order even though the more selective implication is bound first
+        schemes = [Scheme("|- v0".split(), ("v0",)), Scheme("|- ( v0 -> v1 )".split(), ("v0", "v1"))]
+        results = sorted(multibinder(schemes, self.pile), key=str)
+        self.assertEqual(results, [
+            ({"v0": ("ps",), "v1": ("ch",)}, ("|- ps", "|- ( ps -> ch )")),
+            ({"v0": ("ps",), "v1": ("ps",)}, ("|- ps", "|- ( ps -> ps )")),
+        ])
+        self.assertEqual(sorted(multibinder(schemes, PileIndex(self.pile)), key=str), results)
+
+class TestPilebinder(ut.TestCase):
+    def setUp(self):
+        statements = ["|- ps", "|- ( ps -> ch )", "|- ( ch -> ph )", "|- ( ps -> ps )", "wff ps", "|- -. ph"]
+        self.pile = {tuple(statement.split()): statement for statement in statements}
+        self.root = trieify(self.pile)
+
+    def test_counts(self):
+        self.assertEqual(self.root.count, 6)
+        self.assertEqual(self.root.traverse(("|-", "(")).count, 3)
+        self.assertFalse(self.root.add(tuple("|- ps".split()), "|- ps"))
+        self.assertEqual(self.root.count, 6)
+
+    def test_binds(self):
+        # the fully bound scheme is joined last in scheme order but steps still come back in scheme order
+        schemes = [
+            Scheme("|- v0".split(), ("v0",)),
+            Scheme("|- ( v0 -> v1 )".split(), ("v0", "v1")),
+            Scheme("|- ( v1 -> v2 )".split(), ("v1", "v2"))]
+        results = sorted(pilebinder(schemes, self.root), key=str)
+        self.assertEqual(results, [
+            ({"v0": ("ps",), "v1": ("ch",), "v2": ("ph",)}, ("|- ps", "|- ( ps -> ch )", "|- ( ch -> ph )")),
+            ({"v0": ("ps",), "v1": ("ps",), "v2": ("ch",)}, ("|- ps", "|- ( ps -> ps )", "|- ( ps -> ch )")),
+            ({"v0": ("ps",), "v1": ("ps",), "v2": ("ps",)}, ("|- ps", "|- ( ps -> ps )", "|- ( ps -> ps )")),
+        ])
+        self.assertEqual(sorted(multibinder(schemes, self.pile), key=str), results)
+        self.assertEqual(list(pilebinder(schemes + [Scheme("|- -. ch".split(), ())], self.root)), [])
+
+    def test_join_cost(self):
+        # the bare premise of modus ponens is joined first, which turns the implication into a prefix lookup
+        from src.metamathpy.substitution import bound_prefix, join_cost
+        schemes = (Scheme("|- ( v0 -> v1 )".split(), ("v0", "v1")), Scheme("|- v0".split(), ("v0",)))
+        plans = []
+        for scheme in schemes:
+            node, i = bound_prefix(scheme, self.root, {})
+            plans.append((node, i, set(scheme.vartoks[i:])))
+        self.assertLess(join_cost(schemes, plans, 1), join_cost(schemes, plans, 0))
+
+class TestBacksearch(ut.TestCase):
+    @ut.skipIf(importlib.util.find_spec('metamathpy') is None, 'backsearch imports the installed metamathpy package')
+    def test_disjoint(self):
+        import metamathpy.backsearch as bs
+        mp = bs.mp # masks are only comparable within one copy of the proof module
+        db = read(os.path.join('tests', 'dv.mm'))
+        claim = db.rules['alal']
+        rules = [db.rules[label] for label in ('ax-5', 'wal', 'wps', 'vx', 'vy')]
+        success, root = bs.backsearch(tuple(claim.consequent.tokens), rules, claim.disjoint)
+        self.assertTrue(success)
+
+        # inherited requirements are stored as masks, like the steps built by perform
+        self.assertEqual(root.disjoint, mp.disjoint_masks({('ps', 'x'), ('x', 'y')}))
+        self.assertEqual(mp.missing_disjoint(root.disjoint, mp.disjoint_partners(frozenset(claim.disjoint))), set())
+        self.assertEqual(mp.missing_disjoint(root.disjoint, mp.disjoint_partners(frozenset({('x', 'y')}))), {('ps', 'x')})
+
 if __name__ == '__main__':
     ut.main()